@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""Снимок в виде одного потокового архива <timestamp>.tar.gz.
+
+tar-поток режется на блоки, каждый блок сжимается отдельным gzip-членом
+в пуле процессов (как pigz). Склейка gzip-членов - обычный .tar.gz,
+его распаковывает `tar xzf`. Последним файлом в архив кладётся индекс
+(имя -> смещение заголовка в несжатом потоке + таблица блоков), а в самом
+конце идёт пустой gzip-член, в поле EXTRA которого записано смещение блока
+с индексом. Так один файл восстанавливается без распаковки всего архива.
+"""
+import os
+import io
+import gzip
+import hashlib
+import json
+import zlib
+import bisect
+import struct
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+
+SUFFIX = '.tar.gz'
+INDEX_NAME = '.snapshot-index.json'
+BLOCK_SIZE = 4 * 1024 * 1024
+TRAILER = struct.Struct('<4sIBBH2sHQ2sII')
+TRAILER_ID = b'BI'
+
+
+def compress_block(data, level):
+    return gzip.compress(data, level, mtime=0)
+
+
+def make_trailer(index_offset):
+    # gzip-член с FLG.FEXTRA, подполем 'BI' (8 байт смещения) и пустым deflate-потоком
+    return TRAILER.pack(b'\x1f\x8b\x08\x04', 0, 0, 255, 12, TRAILER_ID, 8, index_offset,
+                        b'\x03\x00', 0, 0)
+
+
+class BlockWriter(io.RawIOBase):
+    """Файловый объект для tarfile: копит блоки и сжимает их параллельно."""
+    def __init__(self, out, level=6, workers=1):
+        self.out = out
+        self.level = level
+        self.workers = max(1, workers)
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.buf = bytearray()
+        self.pos = 0              # позиция в несжатом потоке
+        self.pending = []         # (несжатое смещение, future) в порядке записи
+        self.blocks = []          # (сжатое смещение, несжатое смещение)
+        self.comp_pos = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def write(self, data):
+        self.buf += data
+        self.pos += len(data)
+        while len(self.buf) >= BLOCK_SIZE:
+            self._submit(bytes(self.buf[:BLOCK_SIZE]))
+            del self.buf[:BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block):
+        start = self.pos - len(self.buf)
+        self.pending.append((start, self.pool.submit(compress_block, block, self.level)))
+        while len(self.pending) > self.workers * 2:
+            self._drain_one()
+
+    def _drain_one(self):
+        start, fut = self.pending.pop(0)
+        data = fut.result()
+        self.blocks.append((self.comp_pos, start))
+        self.out.write(data)
+        self.comp_pos += len(data)
+
+    def cut(self):
+        """Закончить текущий блок и дописать всё сжатое. Возвращает сжатое смещение."""
+        if self.buf:
+            self._submit(bytes(self.buf))
+            self.buf.clear()
+        while self.pending:
+            self._drain_one()
+        return self.comp_pos
+
+    def close(self):
+        if not self.closed:
+            self.cut()
+            self.pool.shutdown()
+        super().close()
+
+
+class HashingReader:
+    """Обёртка над файлом: считает blake2b того, что прочитал tarfile."""
+    def __init__(self, f, limiter=None):
+        self.f = f
+        self.h = hashlib.blake2b(digest_size=16)
+        self.limiter = limiter
+
+    def read(self, n=-1):
+        data = self.f.read(n)
+        self.h.update(data)
+        if self.limiter:
+            self.limiter.bytes(len(data))
+        return data
+
+
+def write_archive(src_dir, path, level=6, workers=1, limiter=None):
+    """Пишет src_dir в архив path. Возвращает (число объектов, размер архива,
+    записи манифеста [path, size, mtime_ns, hash] для обычных файлов)."""
+    index = {}
+    entries = []
+    with open(path, 'wb') as out:
+        writer = BlockWriter(out, level, workers)
+        try:
+            with tarfile.open(fileobj=writer, mode='w', format=tarfile.PAX_FORMAT) as tar:
+                for root, dirs, files in os.walk(src_dir):
+                    dirs.sort()
+                    for name in [''] + sorted(files + [d for d in dirs
+                                                       if os.path.islink(os.path.join(root, d))]):
+                        full = os.path.join(root, name) if name else root
+                        arcname = os.path.normpath(os.path.relpath(full, src_dir))
+                        info = tar.gettarinfo(full, arcname)
+                        if info is None:
+                            # сокеты в tar не кладутся
+                            continue
+                        if limiter:
+                            limiter.file()
+                        # смещение заголовка, тип, размер, mtime
+                        index[arcname] = [tar.offset, info.type.decode(), info.size, int(info.mtime)]
+                        if info.isreg():
+                            with open(full, 'rb') as f:
+                                reader = HashingReader(f, limiter)
+                                tar.addfile(info, reader)
+                            entries.append([arcname, info.size, os.lstat(full).st_mtime_ns,
+                                            reader.h.hexdigest()])
+                        else:
+                            tar.addfile(info)
+                index_block = writer.cut()
+                data = json.dumps({'blocks': writer.blocks, 'files': index},
+                                  ensure_ascii=False).encode()
+                info = tarfile.TarInfo(INDEX_NAME)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            writer.close()
+        finally:
+            # при ошибке close() не вызывается, а процессы пула надо остановить и так
+            writer.pool.shutdown(cancel_futures=True)
+        out.write(make_trailer(index_block))
+        size = out.tell()
+    return len(index), size, entries
+
+
+class GzipMembersReader(io.RawIOBase):
+    """Читает подряд идущие gzip-члены начиная с произвольного смещения файла."""
+    def __init__(self, f, offset):
+        self.f = f
+        self.f.seek(offset)
+        self.d = zlib.decompressobj(31)
+        self.buf = b''
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        while n < 0 or len(self.buf) < n:
+            if self.d.eof:
+                rest = self.d.unused_data
+                self.d = zlib.decompressobj(31)
+                if rest:
+                    self.buf += self.d.decompress(rest)
+                    continue
+            data = self.f.read(1024 * 1024)
+            if not data:
+                break
+            self.buf += self.d.decompress(data)
+        if n < 0:
+            n = len(self.buf)
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+
+def read_index(path):
+    with open(path, 'rb') as f:
+        f.seek(-TRAILER.size, os.SEEK_END)
+        fields = TRAILER.unpack(f.read(TRAILER.size))
+        if fields[0] != b'\x1f\x8b\x08\x04' or fields[5] != TRAILER_ID:
+            raise ValueError(f'{path}: нет индекса архива')
+        with tarfile.open(fileobj=GzipMembersReader(f, fields[7]), mode='r|') as tar:
+            member = tar.next()
+            return json.load(tar.extractfile(member))
+
+
+def _extract_filter():
+    return {'filter': 'tar'} if hasattr(tarfile, 'data_filter') else {}
+
+
+def extract_one(path, index, name, dest):
+    """Достаёт один элемент name, распаковывая только блоки, где он лежит."""
+    offset = index['files'][name][0]
+    starts = [b[1] for b in index['blocks']]
+    comp_off, block_start = index['blocks'][bisect.bisect_right(starts, offset) - 1]
+    with open(path, 'rb') as f:
+        reader = GzipMembersReader(f, comp_off)
+        skip = offset - block_start
+        while skip:
+            skip -= len(reader.read(min(skip, 1024 * 1024)))
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            tar.extract(tar.next(), dest, **_extract_filter())
+
+
+def extract(path, dest, prefix=''):
+    """Восстанавливает из архива prefix (файл или каталог, '' - всё) в dest."""
+    index = read_index(path)
+    prefix = os.path.normpath(prefix) if prefix else '.'
+    entry = index['files'].get(prefix)
+    if entry and entry[1] != tarfile.DIRTYPE.decode():
+        return extract_one(path, index, prefix, dest)
+
+    def members(tar):
+        for m in tar:
+            if m.name == INDEX_NAME:
+                continue
+            if prefix == '.' or m.name == prefix or m.name.startswith(prefix + '/'):
+                yield m
+
+    with tarfile.open(path, 'r:gz') as tar:
+        tar.extractall(dest, members=members(tar), **_extract_filter())
+
+
+def verify(path, entries):
+    """Читает архив целиком (CRC каждого gzip-члена проверяет zlib) и сверяет
+    blake2b обычных файлов с записями манифеста [path, size, mtime_ns, hash].
+    Возвращает список (статус, path)."""
+    expected = {e[0]: e for e in entries}
+    problems = []
+    try:
+        # 'r|gz' читает только первый gzip-член, а архив из многих членов
+        with tarfile.open(path, 'r:gz') as tar:
+            for m in tar:
+                e = expected.pop(m.name, None)
+                if e is None or not m.isreg():
+                    continue
+                reader = HashingReader(tar.extractfile(m))
+                while reader.read(1024 * 1024):
+                    pass
+                if m.size != e[1]:
+                    problems.append(('size', m.name))
+                elif reader.h.hexdigest() != e[3]:
+                    problems.append(('hash', m.name))
+    except (OSError, EOFError, zlib.error, tarfile.TarError):
+        problems.append(('corrupt', os.path.basename(path)))
+    problems.extend(('missing', name) for name in sorted(expected))
+    return problems
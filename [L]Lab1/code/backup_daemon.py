@@ -1,46 +1,698 @@
 #!/usr/bin/env python3
 import os
+import re
+import stat
+import errno
+import json
 import time
 import shutil
 import syslog as sl
 import configparser as cp
 import datetime as dt
+import chunkstore
+import journal
+import copyengine
+import archive
+import retention
+import manifest
+import runstats
+import throttle
+import checksum
+import threading
+import signal
 
 CONFIG_FILE = "/etc/backup.conf"
+SNAPSHOT_RE = re.compile(r'^\d{8}_\d{6}$')
+# снимок-каталог собирается в <backup>/.inprogress-<timestamp> и публикуется rename'ом
+STAGING_PREFIX = '.inprogress-'
+CHECKPOINT_INTERVAL = 5
 
-def load_config():
+def job_config(config, section, name):
+    """Настройки одной задачи: ключи секции [job:<name>], недостающие берутся из [settings]."""
+    def opt(get, key, default=None):
+        return get(section, key, fallback=get('settings', key, fallback=default))
+
+    backup = config.get(section, 'backup', fallback=None)
+    if not backup and section != 'settings' and config.get('settings', 'backup', fallback=None):
+        # общий каталог из [settings]: у каждой задачи свой подкаталог, иначе задачи
+        # делили бы снимки, журнал, статистику и политику хранения
+        backup = os.path.join(config.get('settings', 'backup'), name)
+    return {
+        'name': name,
+        'source': opt(config.get, 'source'),
+        'backup': backup,
+        'interval': max(1, opt(config.getint, 'interval', 60)),
+        # full - полная копия каждый раз, incremental - жёсткие ссылки на неизменённые файлы
+        'mode': opt(config.get, 'mode', 'full'),
+        # tree - снимки-каталоги, repository - дедуплицирующее хранилище кусков,
+        # archive - один сжатый .tar.gz на снимок
+        'backend': opt(config.get, 'backend', 'tree'),
+        # следить за source через inotify и копировать только изменённое
+        'watch': opt(config.getboolean, 'watch', True),
+        # число потоков копирования
+        'workers': opt(config.getint, 'workers', 4),
+        'compression_level': opt(config.getint, 'compression_level', 6),
+        # файлы не меньше этого размера копируются дельтой от предыдущего снимка, 0 - выкл.
+        'delta_threshold': throttle.parse_size(opt(config.get, 'delta_threshold', '0')),
+        # ограничение нагрузки: байт/с (можно 10M, 512K) и файлов/с, 0 - без ограничений
+        'bwlimit': throttle.parse_size(opt(config.get, 'bwlimit', '0')),
+        'files_per_sec': opt(config.getint, 'files_per_sec', 0),
+        # политика хранения, 0 - правило выключено; все 0 - ничего не удалять
+        **{k: opt(config.getint, k, 0)
+           for k in ('keep_last', 'keep_hourly', 'keep_daily', 'keep_weekly')},
+    }
+
+def load_jobs():
+    """Возвращает ({имя задачи: настройки}, max_concurrent).
+
+    Задачи описываются секциями [job:<name>]; если их нет, единственная
+    задача 'default' берётся из [settings], как раньше. Две задачи с одним
+    каталогом backup - ошибка конфигурации (ValueError).
+    """
     config = cp.ConfigParser()
     config.read(CONFIG_FILE)
+    sections = [s for s in config.sections() if s.startswith('job:')]
+    if not sections:
+        sections = ['settings']
+    jobs = {}
+    for section in sections:
+        name = section[4:] if section.startswith('job:') else 'default'
+        cfg = job_config(config, section, name)
+        if not cfg['source'] or not cfg['backup']:
+            sl.syslog(sl.LOG_ERR, f'Задача {name}: не заданы source/backup, пропущена')
+            continue
+        other = next((n for n, c in jobs.items() if same_dir(c['backup'], cfg['backup'])), None)
+        if other:
+            raise ValueError(f"задачи {other} и {name} пишут в один каталог {cfg['backup']}")
+        jobs[name] = cfg
+    return jobs, config.getint('settings', 'max_concurrent', fallback=2)
+
+def same_dir(a, b):
+    return os.path.realpath(a) == os.path.realpath(b)
+
+def load_config(job=None):
+    """Настройки задачи job (по умолчанию - первой в файле)."""
+    jobs, _ = load_jobs()
+    if not jobs:
+        raise cp.NoOptionError('source', 'settings')
+    if job is None:
+        return next(iter(jobs.values()))
+    if job not in jobs:
+        raise KeyError(f'no such job: {job}')
+    return jobs[job]
+
+def list_snapshots(dst_dir):
+    """Имена снимков-каталогов в dst_dir по возрастанию времени."""
+    try:
+        names = os.listdir(dst_dir)
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names
+                  if SNAPSHOT_RE.match(n) and os.path.isdir(os.path.join(dst_dir, n)))
+
+def list_archives(dst_dir):
+    """Имена снимков-архивов (без суффикса) в dst_dir по возрастанию времени."""
+    try:
+        names = os.listdir(dst_dir)
+    except FileNotFoundError:
+        return []
+    return sorted(n[:-len(archive.SUFFIX)] for n in names
+                  if n.endswith(archive.SUFFIX) and SNAPSHOT_RE.match(n[:-len(archive.SUFFIX)]))
+
+def same_file(st_a, st_b):
+    """Метаданные совпадают настолько, что файл можно не копировать заново."""
+    return (st_a.st_size == st_b.st_size
+            and st_a.st_mtime_ns == st_b.st_mtime_ns
+            and st_a.st_mode == st_b.st_mode)
+
+def make_linker(backup_dir, prev_dir, copy=shutil.copy2, stats=None, limiter=None,
+                delta_threshold=0):
+    """copy_function для copytree: неизменённые файлы берутся жёсткой ссылкой из prev_dir.
+    Изменённые файлы от delta_threshold байт копируются дельтой от версии в prev_dir,
+    copy тогда должна принимать base (CopyEngine.copy)."""
+    def link_or_copy(src, dst):
+        prev = os.path.join(prev_dir, os.path.relpath(dst, backup_dir))
+        try:
+            st, st_prev = os.stat(src), os.stat(prev)
+        except OSError:
+            return copy(src, dst)
+        if same_file(st, st_prev):
+            if limiter:
+                limiter.file()
+            try:
+                os.link(prev, dst)
+                if stats:
+                    stats.add('files_linked')
+                return dst
+            except OSError:
+                pass
+        if delta_threshold and st.st_size >= delta_threshold and stat.S_ISREG(st_prev.st_mode):
+            return copy(src, dst, base=prev)
+        return copy(src, dst)
+    return link_or_copy
+
+def copy_changed(src_dir, prev_dir, backup_dir, dirty, copy_function, stats=None, limiter=None):
+    """Снимок по журналу изменений: всё, кроме dirty, линкуется из prev_dir,
+    пути из dirty (с поддеревьями) берутся из src_dir."""
+    def ignore_dirty(path, names):
+        rel = os.path.relpath(path, prev_dir)
+        return {n for n in names if os.path.normpath(os.path.join(rel, n)) in dirty}
+
+    def link(src, dst):
+        if limiter:
+            limiter.file()
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            # у файла кончился лимит жёстких ссылок - кладём в снимок настоящую копию
+            if e.errno != errno.EMLINK:
+                raise
+            shutil.copy2(src, dst)
+            if stats:
+                stats.add('files_copied')
+                stats.add('bytes_written', os.stat(dst).st_size)
+            return
+        if stats:
+            stats.add('files_linked')
+
+    # ошибки по отдельным файлам копятся и поднимаются в конце, как у copytree
+    errors = []
+    try:
+        shutil.copytree(prev_dir, backup_dir, copy_function=link, ignore=ignore_dirty)
+    except shutil.Error as e:
+        errors.extend(e.args[0])
+    for rel in sorted(dirty):
+        if chunkstore.is_under(os.path.dirname(rel), dirty):
+            continue
+        src = os.path.join(src_dir, rel)
+        dst = os.path.join(backup_dir, rel)
+        if not os.path.lexists(src):
+            continue
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, copy_function=copy_function)
+            else:
+                copy_function(src, dst)
+        except shutil.Error as e:
+            errors.extend(e.args[0])
+        except OSError as e:
+            errors.append((src, dst, str(e)))
+    for rel in sorted({os.path.dirname(r) for r in dirty}, reverse=True):
+        if os.path.isdir(os.path.join(src_dir, rel)) and os.path.isdir(os.path.join(backup_dir, rel)):
+            shutil.copystat(os.path.join(src_dir, rel), os.path.join(backup_dir, rel))
+    if errors:
+        raise shutil.Error(errors)
 
-    source = config.get('settings', 'source')
-    backup = config.get('settings', 'backup')
-    interval = config.getint("settings", 'interval')
-    
-    return source, backup, interval
+class Checkpoint:
+    """Прогресс незавершённого снимка в <staging>.json: откуда копируем и сколько
+    файлов уже пройдено. Сами готовые файлы узнаются по size/mtime в staging -
+    copystat выставляет mtime последним, так что недокопированный файл не совпадёт."""
+    def __init__(self, staging, src_dir, state=None):
+        self.path = staging + '.json'
+        self.state = state or {'source': src_dir, 'started': time.time(), 'files_done': 0}
+        self.saved = 0
+        self.save()
+
+    def file_done(self):
+        self.state['files_done'] += 1
+        if time.monotonic() - self.saved >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+        self.saved = time.monotonic()
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+def load_checkpoint(staging):
+    try:
+        with open(staging + '.json', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def take_staging(dst_dir, src_dir, staging):
+    """Подбирает каталог прерванного запуска для того же source и переименовывает
+    его в staging; остальные незавершённые снимки удаляются. Возвращает состояние
+    контрольной точки подобранного каталога или None."""
+    try:
+        names = sorted(os.listdir(dst_dir), reverse=True)
+    except FileNotFoundError:
+        return None
+    resumed = None
+    for name in names:
+        if not name.startswith(STAGING_PREFIX) or name.endswith(('.json', '.tmp')):
+            continue
+        old = os.path.join(dst_dir, name)
+        state = load_checkpoint(old)
+        # манифест мог успеть записаться перед самым rename
+        manifest.remove(dst_dir, name[len(STAGING_PREFIX):])
+        if resumed is None and state and state.get('source') == src_dir:
+            os.rename(old, staging)
+            resumed = state
+        else:
+            shutil.rmtree(old, ignore_errors=True)
+        for suffix in ('.json', '.json.tmp'):
+            try:
+                os.unlink(old + suffix)
+            except FileNotFoundError:
+                pass
+    return resumed
+
+def drop_missing(staging, src_dir):
+    """Удаляет из подобранного staging то, чего в source уже нет."""
+    for root, dirs, files in os.walk(staging):
+        rel = os.path.relpath(root, staging)
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            if os.path.lexists(os.path.join(src_dir, rel, name)):
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+                dirs.remove(name)
+            else:
+                os.unlink(path)
+
+def skip_done(copy_function, checkpoint):
+    """Обёртка copy_function: файл, уже скопированный прерванным запуском
+    (size/mtime/mode совпадают), не копируется заново."""
+    def copy_or_skip(src, dst):
+        try:
+            st_dst = os.lstat(dst)
+        except FileNotFoundError:
+            pass
+        else:
+            if same_file(os.stat(src), st_dst):
+                checkpoint.file_done()
+                return dst
+            os.unlink(dst)
+        result = copy_function(src, dst)
+        checkpoint.file_done()
+        return result
+    return copy_or_skip
+
+def repository_path(dst_dir):
+    return os.path.join(dst_dir, 'repo')
+
+def count_errors(e):
+    # shutil.Error от copytree несёт список ошибок по отдельным файлам
+    return len(e.args[0]) if isinstance(e, shutil.Error) and isinstance(e.args[0], list) else 1
+
+def backup_repository(src_dir, dst_dir, timestamp, dirty=None, stats=None, limiter=None):
+    repo = chunkstore.Repository(repository_path(dst_dir))
+    try:
+        written, snap = repo.backup(src_dir, timestamp, dirty, stats, limiter)
+        manifest.write(dst_dir, timestamp, [[e['path'], e['size'], e['mtime_ns'], e['hash']]
+                                            for e in snap['files']])
+        sl.syslog(sl.LOG_INFO, f'Создан снимок {timestamp} в {repo.root}, записано {written} байт')
+        return True
+    except Exception as e:
+        sl.syslog(sl.LOG_ERR, f'Не удалось создать снимок {src_dir} -> {repo.root}: {e}')
+        if stats:
+            stats.add('errors', count_errors(e))
+        return False
 
-def copy_files(src_dir, dst_dir):
+def backup_archive(src_dir, dst_dir, timestamp, level=6, workers=1, stats=None, limiter=None):
+    path = os.path.join(dst_dir, timestamp + archive.SUFFIX)
+    tmp = path + '.part'
+    try:
+        os.makedirs(dst_dir, exist_ok=True)
+        count, size, entries = archive.write_archive(src_dir, tmp, level, workers, limiter)
+        os.replace(tmp, path)
+        manifest.write(dst_dir, timestamp, entries)
+        if stats:
+            stats.add('files_scanned', len(entries))
+            stats.add('files_copied', len(entries))
+            stats.add('bytes_written', size)
+        sl.syslog(sl.LOG_INFO, f'Создан архив {path}: {count} объектов, {size} байт')
+        return True
+    except Exception as e:
+        sl.syslog(sl.LOG_ERR, f'Не удалось создать архив {src_dir} -> {path}: {e}')
+        if stats:
+            stats.add('errors', count_errors(e))
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
+
+def copy_files(src_dir, dst_dir, mode='full', backend='tree', dirty=None, workers=1,
+               level=6, stats=None, limiter=None, delta_threshold=0, failed=None):
+    """dirty - множество изменённых путей из журнала, None - полный обход source.
+    stats - runstats.RunStats, куда складываются счётчики этого запуска,
+    limiter - throttle.Limiter с бюджетом байт/с и файлов/с,
+    delta_threshold - размер, начиная с которого файлы копируются дельтой,
+    failed - список, куда добавляются пути source, которые не удалось скопировать."""
     timestamp = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
+    if backend == 'repository':
+        return backup_repository(src_dir, dst_dir, timestamp, dirty, stats, limiter)
+    if backend == 'archive':
+        return backup_archive(src_dir, dst_dir, timestamp, level, workers, stats, limiter)
     backup_dir = os.path.join(dst_dir, timestamp)
+    # пока снимок не готов, он лежит в staging и не виден как снимок
+    staging = os.path.join(dst_dir, STAGING_PREFIX + timestamp)
+    resumed = take_staging(dst_dir, src_dir, staging)
+    if resumed:
+        sl.syslog(sl.LOG_INFO, f"Продолжается прерванный снимок: уже пройдено "
+                               f"{resumed['files_done']} файлов")
+        # по журналу собирается только свежий снимок, прерванный досматривается целиком
+        dirty = None
+    engine = copyengine.CopyEngine(workers, stats, limiter)
+    copy_function = engine.copy
+    prev = list_snapshots(dst_dir) if mode == 'incremental' else []
+    if prev:
+        copy_function = make_linker(staging, os.path.join(dst_dir, prev[-1]), engine.copy,
+                                    stats, limiter, delta_threshold)
+    checkpoint = None
     try:
-        shutil.copytree(src_dir, backup_dir)
+        os.makedirs(dst_dir, exist_ok=True)
+        checkpoint = Checkpoint(staging, src_dir, resumed)
+        if resumed:
+            drop_missing(staging, src_dir)
+        copy_function = skip_done(copy_function, checkpoint)
+        if stats:
+            inner = copy_function
+
+            def copy_function(src, dst):
+                stats.add('files_scanned')
+                return inner(src, dst)
+        # ошибки отдельных файлов (битая ссылка, нет прав, FIFO) не мешают
+        # опубликовать снимок: иначе каждый следующий запуск подбирал бы этот
+        # staging и спотыкался о тот же файл
+        errors = []
+        try:
+            try:
+                if prev and dirty is not None:
+                    copy_changed(src_dir, os.path.join(dst_dir, prev[-1]), staging, dirty,
+                                 copy_function, stats, limiter)
+                else:
+                    shutil.copytree(src_dir, staging, copy_function=copy_function,
+                                    dirs_exist_ok=True)
+            except shutil.Error as e:
+                errors.extend(e.args[0])
+        finally:
+            try:
+                engine.wait()
+            except shutil.Error as e:
+                errors.extend(e.args[0])
+        if errors:
+            for src, _, why in errors[:10]:
+                sl.syslog(sl.LOG_WARNING, f'Не скопирован {src}: {why}')
+            sl.syslog(sl.LOG_WARNING, f'Снимок {timestamp} без {len(errors)} файлов с ошибками')
+            if stats:
+                stats.add('errors', len(errors))
+            if failed is not None:
+                failed.extend(src for src, _, _ in errors)
+        last = list_snapshots(dst_dir)[-1:]
+        prev_entries = manifest.load(dst_dir, last[0]) if last else {}
+        # по журналу можно только если у предыдущего снимка есть манифест
+        changed = dirty if prev and dirty is not None and prev_entries else None
+        # кеш занят backupctl verify - не ждём, хешируем без него
+        with checksum.ChecksumCache(dst_dir, wait=False) as cache:
+            entries = manifest.scan_tree(staging, prev_entries, changed, cache or None, limiter)
+        manifest.write(dst_dir, timestamp, entries)
+        os.rename(staging, backup_dir)
+        checkpoint.remove()
         sl.syslog(sl.LOG_INFO, f'\nСоздана резервная копия {backup_dir}')
-        
+        return True
+
     except Exception as e:
-        sl.syslog(sl.LOG_ERR, f'Не удалось копировать {src_dir} -> {dst_dir}')
+        sl.syslog(sl.LOG_ERR, f'Не удалось копировать {src_dir} -> {dst_dir}, '
+                              f'незавершённый снимок оставлен для продолжения: {e}')
+        if checkpoint:
+            try:
+                checkpoint.save()
+            except OSError:
+                pass
+        if stats:
+            stats.add('errors', count_errors(e))
+        return False
 
-def main():
-    while True:
-        src_dir, dst_dir, interval = load_config()
-        copy_files(src_dir, dst_dir)
-        time.sleep(interval)
+def snapshot_names(cfg):
+    if cfg['backend'] == 'repository':
+        return chunkstore.Repository(repository_path(cfg['backup'])).snapshots()
+    if cfg['backend'] == 'archive':
+        return list_archives(cfg['backup'])
+    return list_snapshots(cfg['backup'])
 
+def prune_snapshots(cfg, dry_run=False):
+    """Удаляет снимки, не попадающие под политику хранения. Возвращает список удалённых."""
+    _, expired = retention.select(snapshot_names(cfg), cfg)
+    if dry_run or not expired:
+        return expired
+    dst_dir = cfg['backup']
+    for name in expired:
+        manifest.remove(dst_dir, name)
+    if cfg['backend'] == 'repository':
+        repo = chunkstore.Repository(repository_path(dst_dir))
+        for name in expired:
+            repo.delete_snapshot(name)
+        removed, freed = repo.gc()
+        sl.syslog(sl.LOG_INFO, f'Удалено кусков: {removed}, освобождено {freed} байт')
+    elif cfg['backend'] == 'archive':
+        for name in expired:
+            os.unlink(os.path.join(dst_dir, name + archive.SUFFIX))
+    else:
+        # сначала переименование (мгновенно и атомарно), потом медленное rmtree
+        trash = os.path.join(dst_dir, '.trash')
+        os.makedirs(trash, exist_ok=True)
+        for name in expired:
+            os.rename(os.path.join(dst_dir, name), os.path.join(trash, name))
+        for name in os.listdir(trash):
+            shutil.rmtree(os.path.join(trash, name), ignore_errors=True)
+    sl.syslog(sl.LOG_INFO, f'Удалено снимков по политике хранения: {len(expired)}')
+    return expired
 
-if __name__ == "__main__":
-    sl.openlog(ident="backup_daemon", logoption=sl.LOG_PID)
-    main()
+def verify_snapshots(cfg, names, jobs=1, full=False):
+    """Сверяет снимки с их манифестами. Для каждого имени выдаёт (имя, проблемы),
+    проблемы - список (статус, path) или None, если манифеста нет.
+    full - читать все файлы, не доверяя кешу контрольных сумм."""
+    dst_dir = cfg['backup']
+    known = set(manifest.names(dst_dir))
+    if cfg['backend'] == 'repository':
+        repo = chunkstore.Repository(repository_path(dst_dir))
+        checked = {}
+        for name in names:
+            yield name, repo.verify(name, jobs, checked)
+    elif cfg['backend'] == 'archive':
+        for name in names:
+            if name not in known:
+                yield name, None
+                continue
+            yield name, archive.verify(os.path.join(dst_dir, name + archive.SUFFIX),
+                                       manifest.iter_entries(dst_dir, name))
+    else:
+        with checksum.ChecksumCache(dst_dir) as cache:
+            seen = set()
+            for name in names:
+                if name not in known:
+                    yield name, None
+                    continue
+                yield name, checksum.verify_tree(os.path.join(dst_dir, name),
+                                                 manifest.iter_entries(dst_dir, name),
+                                                 cache, jobs, full, seen)
+            # после проверки всех снимков из кеша можно выбросить удалённые файлы
+            if set(names) >= set(list_snapshots(dst_dir)):
+                cache.retain(seen)
+
+class Pruner(threading.Thread):
+    """Фоновая очистка: цикл резервного копирования только ставит флаг."""
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def request(self, cfg):
+        if retention.enabled(cfg):
+            with self.lock:
+                self.pending[cfg['name']] = cfg
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            for cfg in pending.values():
+                try:
+                    prune_snapshots(cfg)
+                except Exception as e:
+                    sl.syslog(sl.LOG_ERR, f"Задача {cfg['name']}: ошибка очистки старых снимков: {e}")
+
+def record_run(cfg, stats, ok, dirty):
+    run = stats.finish(ok=ok, backend=cfg['backend'], mode=cfg['mode'],
+                       interval=cfg['interval'], journal=dirty is not None)
+    runstats.record(cfg['backup'], run)
+    if run['duration'] > cfg['interval']:
+        sl.syslog(sl.LOG_WARNING, f"Резервное копирование шло {run['duration']:.1f} с, "
+                                  f"дольше интервала {cfg['interval']} с")
+
+def start_journal(cfg):
+    if not cfg['watch']:
+        return None
+    jrnl = journal.ChangeJournal(cfg['source'], os.path.join(cfg['backup'], '.journal'))
+    try:
+        os.makedirs(cfg['backup'], exist_ok=True)
+        jrnl.start()
+    except OSError as e:
+        sl.syslog(sl.LOG_WARNING, f'inotify недоступен, каждый цикл будет полным обходом: {e}')
+        return None
+    return jrnl
+
+class Job:
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.running = False
+        self.jrnl = None
+        self.watched = None
+        self.anchor = time.monotonic()
+        self.next_run = self.anchor
+        self.limiter = throttle.Limiter(cfg['bwlimit'], cfg['files_per_sec'])
+
+    def reconfigure(self, cfg):
+        if cfg['interval'] != self.cfg['interval']:
+            self.anchor = self.next_run = time.monotonic()
+        if (cfg['bwlimit'], cfg['files_per_sec']) != (self.cfg['bwlimit'], self.cfg['files_per_sec']):
+            self.limiter = throttle.Limiter(cfg['bwlimit'], cfg['files_per_sec'])
+        self.cfg = cfg
+
+    def run(self, pruner):
+        cfg = self.cfg
+        if self.watched != (cfg['source'], cfg['backup'], cfg['watch']):
+            if self.jrnl:
+                self.jrnl.stop()
+            self.jrnl = start_journal(cfg)
+            self.watched = (cfg['source'], cfg['backup'], cfg['watch'])
+        seq, dirty = self.jrnl.take() if self.jrnl else (0, None)
+        if dirty is not None and not dirty:
+            sl.syslog(sl.LOG_DEBUG, f"Задача {cfg['name']}: изменений нет, снимок не нужен")
+            return
+        stats = runstats.RunStats()
+        failed = []
+        ok = copy_files(cfg['source'], cfg['backup'], cfg['mode'], cfg['backend'], dirty,
+                        cfg['workers'], cfg['compression_level'], stats, self.limiter or None,
+                        cfg['delta_threshold'], failed)
+        if ok:
+            if self.jrnl:
+                self.jrnl.commit(seq)
+                # не скопированные файлы снова в журнал - попробуем в следующем цикле
+                self.jrnl.retry(failed)
+            pruner.request(cfg)
+        record_run(cfg, stats, ok, dirty)
+
+    def stop(self):
+        if self.jrnl:
+            self.jrnl.stop()
+            self.jrnl = None
+            self.watched = None
+
+class Scheduler:
+    """Запуск задач по расписанию anchor + k*interval (без дрейфа), не больше
+    max_concurrent одновременно; если прошлый запуск задачи ещё идёт, очередной
+    слот пропускается."""
+    def __init__(self):
+        self.jobs = {}
+        # число одновременных запусков; лимит можно менять, пока задачи идут
+        self.slots = threading.Condition()
+        self.max_concurrent = 1
+        self.active = 0
+        self.pruner = Pruner()
+        self.pruner.start()
+
+    def configure(self, jobs, max_concurrent):
+        for name in list(self.jobs):
+            if name not in jobs:
+                self.jobs.pop(name).stop()
+        for name, cfg in jobs.items():
+            if name in self.jobs:
+                self.jobs[name].reconfigure(cfg)
+            else:
+                self.jobs[name] = Job(cfg)
+        with self.slots:
+            # уменьшенный лимит вступает в силу по мере завершения идущих задач
+            self.max_concurrent = max(1, max_concurrent)
+            self.slots.notify_all()
+        sl.syslog(sl.LOG_INFO, f"Задачи: {', '.join(self.jobs) or 'нет'}, "
+                               f"одновременно не больше {max(1, max_concurrent)}")
 
+    def _run(self, job):
+        try:
+            with self.slots:
+                self.slots.wait_for(lambda: self.active < self.max_concurrent)
+                self.active += 1
+            try:
+                job.run(self.pruner)
+            finally:
+                with self.slots:
+                    self.active -= 1
+                    self.slots.notify_all()
+        except Exception as e:
+            sl.syslog(sl.LOG_ERR, f"Задача {job.cfg['name']}: {e}")
+        finally:
+            job.running = False
 
+    def run_due(self):
+        """Запускает задачи, чьё время пришло. Возвращает, сколько спать до следующей."""
+        now = time.monotonic()
+        for job in self.jobs.values():
+            if now < job.next_run:
+                continue
+            if job.running:
+                sl.syslog(sl.LOG_WARNING, f"Задача {job.cfg['name']}: предыдущий запуск ещё идёт, "
+                                          f"слот пропущен")
+            else:
+                job.running = True
+                threading.Thread(target=self._run, args=(job,), daemon=True).start()
+            interval = job.cfg['interval']
+            job.next_run = job.anchor + ((now - job.anchor) // interval + 1) * interval
+        if not self.jobs:
+            return 60
+        return max(0, min(j.next_run for j in self.jobs.values()) - time.monotonic())
 
+    def stop(self):
+        """Штатная остановка: журналы закрываются меткой и будут приняты после запуска."""
+        for job in self.jobs.values():
+            job.stop()
 
+def lower_priority():
+    config = cp.ConfigParser()
+    config.read(CONFIG_FILE)
+    errors = throttle.lower_priority(config.getint('settings', 'nice', fallback=0),
+                                     config.get('settings', 'ionice', fallback=''))
+    for err in errors:
+        sl.syslog(sl.LOG_WARNING, f'Не удалось понизить приоритет: {err}')
+
+def main():
+    reload = threading.Event()
+    reload.set()
+    terminate = []
+    signal.signal(signal.SIGHUP, lambda *_: reload.set())
+    signal.signal(signal.SIGTERM, lambda *_: (terminate.append(1), reload.set()))
+    scheduler = Scheduler()
+    while not terminate:
+        if reload.is_set():
+            reload.clear()
+            try:
+                scheduler.configure(*load_jobs())
+                # nice/ionice тоже из конфига: применяются и к уже идущим потокам
+                lower_priority()
+            except (cp.Error, ValueError) as e:
+                sl.syslog(sl.LOG_ERR, f'Ошибка в {CONFIG_FILE}, оставлены старые настройки: {e}')
+        reload.wait(scheduler.run_due())
+    scheduler.stop()
+    sl.syslog(sl.LOG_INFO, 'Остановлен')
 
 
+if __name__ == "__main__":
+    sl.openlog(ident="backup_daemon", logoption=sl.LOG_PID)
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Нагрузочный стенд для copy_files: синтетические деревья и замеры по режимам.
+
+    bench.py [--dir DIR] [--scale N] [--profiles ...] [--modes ...] [--json]
+
+Деревья генерируются детерминированно из --seed: много мелких файлов, несколько
+огромных, глубокая вложенность и смесь. Для каждого режима делается первый
+снимок, затем часть файлов меняется (правка на месте, перезапись, новые и
+удалённые файлы) и снимается второй. Каждый снимок выполняется в отдельном
+процессе: так пиковый RSS и счётчики системных вызовов относятся только к нему.
+Время и скорость берутся из прогона без трассировки. Системные вызовы, если есть
+strace, считает отдельный неучитываемый прогон под strace -f -c на копии каталога
+снимков (под ptrace всё идёт в разы медленнее); read/write вызовы из
+/proc/<pid>/io выводятся всегда.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess as sp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+MB = 1024 * 1024
+PROFILES = ('small', 'huge', 'deep', 'mixed')
+# режим: (backend, mode, использовать журнал изменений, порог дельты)
+MODES = {
+    'tree-full': ('tree', 'full', False, 0),
+    'tree-incremental': ('tree', 'incremental', False, 0),
+    'tree-journal': ('tree', 'incremental', True, 0),
+    'tree-delta': ('tree', 'incremental', False, MB),
+    'repository': ('repository', 'incremental', False, 0),
+    'archive': ('archive', 'full', False, 0),
+}
+
+
+def write_file(path, rng, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        while size > 0:
+            n = min(size, 4 * MB)
+            f.write(rng.randbytes(n))
+            size -= n
+
+
+def generate(root, profile, scale=1, seed=0):
+    """Создаёт дерево profile в root. Возвращает (число файлов, байт)."""
+    rng = random.Random(f'{seed}:{profile}')
+    files = []
+    if profile in ('small', 'mixed'):
+        for i in range(int(5000 * scale)):
+            files.append((f'small/d{i % 50:02}/f{i:06}.txt', rng.randint(100, 16 * 1024)))
+    if profile in ('huge', 'mixed'):
+        for i in range(max(1, int(2 * scale))):
+            files.append((f'huge/image{i}.bin', 64 * MB))
+    if profile in ('deep', 'mixed'):
+        for i in range(int(500 * scale)):
+            depth = rng.randint(10, 40)
+            path = '/'.join(f'n{rng.randint(0, 2)}' for _ in range(depth))
+            files.append((f'deep/{path}/f{i:05}', rng.randint(100, 4096)))
+    for rel, size in files:
+        write_file(os.path.join(root, rel), rng, size)
+    return len(files), sum(size for _, size in files)
+
+
+def mutate(root, fraction=0.1, seed=0):
+    """Меняет долю файлов дерева: крупные правятся на месте мелкими кусками,
+    мелкие перезаписываются, ~1% удаляется и ~1% добавляется.
+    Возвращает множество изменённых путей (как их отдал бы журнал)."""
+    rng = random.Random(f'{seed}:mutate')
+    paths = sorted(os.path.relpath(os.path.join(d, f), root)
+                   for d, _, files in os.walk(root) for f in files)
+    dirty = set()
+    for rel in paths:
+        full = os.path.join(root, rel)
+        roll = rng.random()
+        if roll < 0.01:
+            os.unlink(full)
+        elif roll < 0.01 + fraction:
+            size = os.path.getsize(full)
+            with open(full, 'r+b') as f:
+                if size > 4 * MB:
+                    for _ in range(4):
+                        f.seek(rng.randrange(size - 4096))
+                        f.write(rng.randbytes(4096))
+                else:
+                    f.truncate(0)
+                    f.write(rng.randbytes(rng.randint(100, 16 * 1024)))
+        else:
+            continue
+        dirty.add(rel)
+        if os.path.exists(full):
+            # mtime сдвигается явно: правка может уложиться в тот же тик часов
+            st = os.stat(full)
+            os.utime(full, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    for i in range(max(1, len(paths) // 100)):
+        rel = f'added/new{i:05}.bin'
+        write_file(os.path.join(root, rel), rng, rng.randint(100, 64 * 1024))
+        dirty.add(rel)
+    return dirty
+
+
+def run_one(task):
+    """Выполняется в дочернем процессе: один вызов copy_files."""
+    import backup_daemon as bd
+    import runstats
+    stats = runstats.RunStats()
+    dirty = set(task['dirty']) if task['dirty'] is not None else None
+    ok = bd.copy_files(task['src'], task['dst'], task['mode'], task['backend'], dirty,
+                       task['workers'], 6, stats, None, task['delta_threshold'])
+    result = stats.finish(ok=ok)
+    result['rss_kb'] = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    with open('/proc/self/io') as f:
+        io = dict(line.split(': ') for line in f.read().splitlines())
+    result['syscr'], result['syscw'] = int(io['syscr']), int(io['syscw'])
+    print(json.dumps(result))
+
+
+def strace_total(path):
+    """Итоговое число вызовов из отчёта strace -c (строка 'total')."""
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if parts and parts[-1] == 'total':
+                return int(parts[3])
+    return None
+
+
+def run_child(task, prefix=()):
+    cmd = list(prefix) + [sys.executable, os.path.abspath(__file__), '--run', json.dumps(task)]
+    out = sp.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure(task, workdir):
+    """Чистый замер на task['dst'] и, если есть strace, подсчёт системных вызовов
+    таким же снимком на копии dst в состоянии до замера."""
+    shadow = None
+    if shutil.which('strace'):
+        shadow = os.path.join(workdir, 'dst-strace')
+        shutil.rmtree(shadow, ignore_errors=True)
+        if os.path.exists(task['dst']):
+            shutil.copytree(task['dst'], shadow, symlinks=True)
+    result = run_child(task)
+    result['syscalls'] = None
+    if shadow:
+        trace = os.path.join(workdir, 'strace.out')
+        run_child(dict(task, dst=shadow), ['strace', '-f', '-c', '-o', trace])
+        result['syscalls'] = strace_total(trace)
+        shutil.rmtree(shadow, ignore_errors=True)
+    return result
+
+
+def bench(workdir, profile, mode, args):
+    backend, bmode, use_journal, delta_threshold = MODES[mode]
+    src = os.path.join(workdir, 'src')
+    dst = os.path.join(workdir, 'dst')
+    for d in (src, dst):
+        shutil.rmtree(d, ignore_errors=True)
+    generate(src, profile, args.scale, args.seed)
+    task = {'src': src, 'dst': dst, 'mode': bmode, 'backend': backend, 'dirty': None,
+            'workers': args.workers, 'delta_threshold': delta_threshold}
+    rows = []
+    for phase in ('first', 'second'):
+        if phase == 'second':
+            dirty = mutate(src, args.changed, args.seed)
+            task['dirty'] = sorted(dirty) if use_journal else None
+            # снимки именуются по секундам
+            time.sleep(1.1)
+        r = measure(task, workdir)
+        mb = (r['bytes_written'] + r.get('bytes_reused', 0)) / MB
+        rows.append({'profile': profile, 'mode': mode, 'phase': phase, 'ok': r['ok'],
+                     'files': r['files_scanned'], 'duration': r['duration'],
+                     'files_per_sec': r['files_scanned'] / r['duration'] if r['duration'] else 0,
+                     'mb_per_sec': mb / r['duration'] if r['duration'] else 0,
+                     'written_mb': r['bytes_written'] / MB, 'rss_mb': r['rss_kb'] / 1024,
+                     'syscalls': r['syscalls'], 'syscr': r['syscr'], 'syscw': r['syscw']})
+    return rows
+
+
+def print_table(rows):
+    print(f"{'profile':8} {'mode':17} {'phase':6} {'files':>7} {'sec':>7} {'files/s':>9} "
+          f"{'MB/s':>8} {'written':>9} {'RSS MB':>7} {'syscalls':>10} {'read/write':>13}")
+    for r in rows:
+        syscalls = r['syscalls'] if r['syscalls'] is not None else '-'
+        print(f"{r['profile']:8} {r['mode']:17} {r['phase']:6} {r['files']:>7} "
+              f"{r['duration']:>7.2f} {r['files_per_sec']:>9.0f} {r['mb_per_sec']:>8.1f} "
+              f"{r['written_mb']:>8.1f}M {r['rss_mb']:>7.1f} {syscalls:>10} "
+              f"{r['syscr']:>6}/{r['syscw']:<6}" + ('' if r['ok'] else '  FAILED'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark backup_daemon.copy_files on synthetic trees')
+    parser.add_argument('--dir', help='work directory (default: a fresh temp dir, removed afterwards)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply tree sizes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--changed', type=float, default=0.1, help='fraction of files changed between runs')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--json', action='store_true', help='print rows as JSON lines')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return run_one(json.loads(args.run))
+
+    workdir = args.dir or tempfile.mkdtemp(prefix='backup-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    rows = []
+    try:
+        for profile in args.profiles:
+            for mode in args.modes:
+                for r in bench(workdir, profile, mode, args):
+                    rows.append(r)
+                    if args.json:
+                        print(json.dumps(r), flush=True)
+    finally:
+        if not args.dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if not args.json:
+        print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Кеш контрольных сумм файлов снимков: <backup>/.checksums (dbm).
+
+Ключ - (st_dev, st_ino), значение - размер, mtime_ns и blake2b, посчитанный
+при последнем чтении. Пока размер и mtime файла те же, хеш берётся из кеша
+без чтения. Снимки-каталоги делят inode через жёсткие ссылки, поэтому
+неизменённый файл хешируется один раз на все снимки, где он есть.
+"""
+import os
+import dbm
+import fcntl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from manifest import file_hash
+
+FILE_NAME = '.checksums'
+
+
+def cache_path(dst_dir):
+    return os.path.join(dst_dir, FILE_NAME)
+
+
+def _key(st):
+    return f'{st.st_dev}:{st.st_ino}'
+
+
+class ChecksumCache:
+    """Открывается через with: на время работы берётся flock, чтобы демон
+    и backupctl verify не писали в базу одновременно. С wait=False занятый
+    кеш не ждём - объект тогда ложен, и вызывающий обходится без кеша."""
+    def __init__(self, dst_dir, wait=True):
+        self.path = cache_path(dst_dir)
+        self.wait = wait
+        self.lock = threading.Lock()
+        self.db = None
+        self.lock_file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock_file = open(self.path + '.lock', 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | (0 if self.wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return self
+        self.db = dbm.open(self.path, 'c')
+        return self
+
+    def __exit__(self, *exc):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        self.lock_file.close()
+
+    def __bool__(self):
+        return self.db is not None
+
+    def get(self, st):
+        with self.lock:
+            value = self.db.get(_key(st))
+        if value is None:
+            return None
+        size, mtime_ns, h = value.decode().split(':')
+        if int(size) == st.st_size and int(mtime_ns) == st.st_mtime_ns:
+            return h
+        return None
+
+    def put(self, st, h):
+        with self.lock:
+            self.db[_key(st)] = f'{st.st_size}:{st.st_mtime_ns}:{h}'
+
+    def hash_file(self, path, st=None, limiter=None):
+        st = st or os.stat(path)
+        h = self.get(st)
+        if h is None:
+            h = file_hash(path, limiter)
+            self.put(st, h)
+        return h
+
+    def retain(self, live):
+        """Удаляет записи о файлах, которых больше нет ни в одном снимке."""
+        with self.lock:
+            for k in [k for k in self.db.keys() if k.decode() not in live]:
+                del self.db[k]
+
+
+def verify_tree(root, entries, cache, jobs=1, full=False, seen=None):
+    """Сверяет файлы снимка-каталога root с записями манифеста.
+    Возвращает список (статус, path): 'missing', 'size' или 'hash'.
+    Без full файлы с попаданием в кеш не читаются; seen собирает ключи
+    кеша всех проверенных файлов."""
+    problems = []
+    todo = []
+    for e in entries:
+        try:
+            st = os.stat(os.path.join(root, e[0]))
+        except FileNotFoundError:
+            problems.append(('missing', e[0]))
+            continue
+        if seen is not None:
+            seen.add(_key(st))
+        if st.st_size != e[1]:
+            problems.append(('size', e[0]))
+            continue
+        h = None if full else cache.get(st)
+        if h is None:
+            todo.append((e, st))
+        elif h != e[3]:
+            problems.append(('hash', e[0]))
+
+    def check(item):
+        e, st = item
+        h = file_hash(os.path.join(root, e[0]))
+        cache.put(st, h)
+        return e, h
+
+    with ThreadPoolExecutor(max(1, jobs)) as pool:
+        for e, h in pool.map(check, todo):
+            if h != e[3]:
+                problems.append(('hash', e[0]))
+    return sorted(problems, key=lambda p: p[1])
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Репозиторий резервных копий с дедупликацией.
+
+Файлы режутся на куски переменной длины (content-defined chunking, XOR-хеш окна),
+каждый кусок хранится один раз под своим хешем в chunks/xx/<hash>,
+а снимок - это манифест snapshots/<timestamp>.json со списком кусков для каждого файла.
+"""
+import os
+import stat
+import json
+import zlib
+import fcntl
+import hashlib
+import functools
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+# хеш окна - XOR байтовых значений TABLE по WINDOW байтам; граница там, где хеши
+# трёх соседних окон равны CUT_MAGIC по маскам CUT_MASKS (8 + 8 + 4 бита),
+# т.е. с вероятностью 2^-20 на байт -> средний размер ~1 МиБ
+WINDOW = 16
+CUT_MAGIC = (0x5a, 0xc3, 0x09)
+CUT_MASKS = (0xff, 0xff, 0x0f)
+TABLE = bytes(hashlib.blake2b(bytes([i]), digest_size=1).digest()[0] for i in range(256))
+# данные просматриваются блоками: весь блок обрабатывается операциями над
+# длинным целым (байт на позицию), а не циклом Python по каждому байту
+SCAN_BLOCK = 256 * 1024
+
+
+@functools.lru_cache(maxsize=8)
+def _repeat(value, n):
+    """Целое из n байт value - константа для сравнения всех позиций блока сразу."""
+    return int.from_bytes(bytes([value]) * n, 'little')
+
+
+def cut_point(buf):
+    n = min(len(buf), MAX_CHUNK)
+    if n <= MIN_CHUNK:
+        return n
+    view = memoryview(buf)
+    back = len(CUT_MAGIC) * WINDOW - 1
+    for start in range(MIN_CHUNK, n, SCAN_BLOCK):
+        size = min(SCAN_BLOCK, n - start)
+        x = int.from_bytes(view[start - back:start + size].tobytes().translate(TABLE), 'little')
+        # после сдвигов-удвоений байт i равен XOR байтов i-WINDOW+1..i
+        span = 8
+        while span < WINDOW * 8:
+            x ^= x << span
+            span *= 2
+        miss = 0
+        for k, (magic, mask) in enumerate(zip(CUT_MAGIC, CUT_MASKS)):
+            lanes = x >> (back - k * WINDOW) * 8
+            if mask != 0xff:
+                lanes &= _repeat(mask, size)
+            miss |= lanes ^ _repeat(magic, size)
+        # нулевой байт miss - позиция, где совпали все три окна
+        hit = miss.to_bytes(size + back + WINDOW, 'little')[:size].find(0)
+        if hit >= 0:
+            return start + hit + 1
+    return n
+
+
+def iter_chunks(fh):
+    buf = b''
+    eof = False
+    while True:
+        while not eof and len(buf) < MAX_CHUNK:
+            data = fh.read(MAX_CHUNK)
+            if data:
+                buf += data
+            else:
+                eof = True
+        if not buf:
+            return
+        cut = cut_point(buf)
+        yield buf[:cut]
+        buf = buf[cut:]
+
+
+def is_under(path, paths):
+    """path или один из его родителей входит в множество paths."""
+    while path and path != '.':
+        if path in paths:
+            return True
+        path = os.path.dirname(path)
+    return False
+
+
+def chunk_id(data):
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+class Repository:
+    def __init__(self, root):
+        self.root = root
+        self.chunks_dir = os.path.join(root, 'chunks')
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+        self.stats = None
+        self.limiter = None
+
+    def init(self):
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+    def chunk_path(self, cid):
+        return os.path.join(self.chunks_dir, cid[:2], cid)
+
+    def put_chunk(self, data):
+        """Сохраняет кусок, если его ещё нет. Возвращает (id, записано байт)."""
+        cid = chunk_id(data)
+        path = self.chunk_path(cid)
+        try:
+            # свежий mtime защищает кусок от параллельной сборки мусора
+            os.utime(path)
+            return cid, 0
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        packed = zlib.compress(data, 6)
+        tmp = f'{path}.tmp{os.getpid()}'
+        with open(tmp, 'wb') as f:
+            f.write(packed)
+        os.replace(tmp, path)
+        return cid, len(packed)
+
+    def get_chunk(self, cid):
+        with open(self.chunk_path(cid), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def snapshots(self):
+        try:
+            names = os.listdir(self.snapshots_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(n[:-5] for n in names if n.endswith('.json'))
+
+    def load_manifest(self, name):
+        with open(os.path.join(self.snapshots_dir, name + '.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_manifest(self, name, manifest):
+        path = os.path.join(self.snapshots_dir, name + '.json')
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @contextlib.contextmanager
+    def locked(self, exclusive=False):
+        """flock на <root>/lock: снимки пишутся под разделяемой блокировкой, gc
+        идёт под исключительной и ждёт, пока идущие снимки сохранят манифесты."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, 'lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def delete_snapshot(self, name):
+        os.unlink(os.path.join(self.snapshots_dir, name + '.json'))
+
+    def gc(self):
+        """Удаляет куски, на которые не ссылается ни один манифест.
+        Идёт под исключительной блокировкой, так что снимки, которые пишутся
+        параллельно, успевают сохранить манифесты до поиска ссылок.
+        Возвращает (удалено кусков, освобождено байт)."""
+        with self.locked(exclusive=True):
+            started = time.time()
+            used = set()
+            for name in self.snapshots():
+                for e in self.load_manifest(name)['files']:
+                    used.update(e['chunks'])
+            removed = freed = 0
+            for sub in os.listdir(self.chunks_dir) if os.path.isdir(self.chunks_dir) else []:
+                subdir = os.path.join(self.chunks_dir, sub)
+                for cid in os.listdir(subdir):
+                    if cid in used:
+                        continue
+                    path = os.path.join(subdir, cid)
+                    try:
+                        st = os.stat(path)
+                        if st.st_mtime >= started:
+                            continue
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        continue
+                    removed += 1
+                    freed += st.st_size
+            return removed, freed
+
+    def _count(self, key, n=1):
+        if self.stats:
+            self.stats.add(key, n)
+
+    def _add_file(self, full, rel, prev_files, manifest):
+        self._count('files_scanned')
+        if self.limiter:
+            self.limiter.file()
+        try:
+            return self._store_file(full, rel, prev_files, manifest)
+        except FileNotFoundError:
+            # файл исчез между listdir и чтением: в снимок не попадает,
+            # как и в обычном копировании, считается ошибкой
+            self._count('errors')
+            return 0
+
+    def _store_file(self, full, rel, prev_files, manifest):
+        if os.path.islink(full):
+            manifest['symlinks'].append({'path': rel, 'target': os.readlink(full)})
+            return 0
+        st = os.stat(full)
+        if not stat.S_ISREG(st.st_mode):
+            # FIFO, сокеты, устройства: open() на FIFO без писателя повис бы
+            self._count('errors')
+            return 0
+        entry = {'path': rel, 'mode': st.st_mode, 'mtime_ns': st.st_mtime_ns,
+                 'size': st.st_size}
+        written = 0
+        old = prev_files.get(rel)
+        if old and 'hash' in old and all(old[k] == entry[k] for k in ('mode', 'mtime_ns', 'size')):
+            entry['chunks'] = old['chunks']
+            entry['hash'] = old['hash']
+            self._count('files_linked')
+        else:
+            entry['chunks'] = []
+            h = hashlib.blake2b(digest_size=16)
+            with open(full, 'rb') as f:
+                for data in iter_chunks(f):
+                    if self.limiter:
+                        self.limiter.bytes(len(data))
+                    h.update(data)
+                    cid, n = self.put_chunk(data)
+                    entry['chunks'].append(cid)
+                    written += n
+            entry['hash'] = h.hexdigest()
+            self._count('files_copied')
+            self._count('bytes_written', written)
+        manifest['files'].append(entry)
+        return written
+
+    def _scan(self, src_dir, top, prev_files, manifest):
+        written = 0
+        for root, dirs, files in os.walk(top):
+            dirs.sort()
+            rel_root = os.path.relpath(root, src_dir)
+            try:
+                st = os.stat(root)
+            except FileNotFoundError:
+                # каталог удалили во время обхода
+                dirs[:] = []
+                self._count('errors')
+                continue
+            manifest['dirs'].append({'path': rel_root, 'mode': st.st_mode,
+                                     'mtime_ns': st.st_mtime_ns})
+            for name in sorted(files + [d for d in dirs if os.path.islink(os.path.join(root, d))]):
+                written += self._add_file(os.path.join(root, name),
+                                          os.path.normpath(os.path.join(rel_root, name)),
+                                          prev_files, manifest)
+        return written
+
+    def backup(self, src_dir, name, dirty=None, stats=None, limiter=None):
+        """Создаёт снимок src_dir. Неизменённые файлы (size/mtime/mode) берутся
+        из предыдущего манифеста без чтения. Если задано dirty (пути из журнала
+        изменений), читаются только они, остальное переносится из предыдущего
+        манифеста. Возвращает (число записанных байт, манифест)."""
+        self.init()
+        # под разделяемой блокировкой: gc не удалит кусок, который этот снимок
+        # уже переиспользовал, но ещё не записал в манифест
+        with self.locked():
+            self.stats = stats
+            self.limiter = limiter
+            prev_manifest = None
+            prev = self.snapshots()
+            if prev:
+                prev_manifest = self.load_manifest(prev[-1])
+            prev_files = {e['path']: e for e in prev_manifest['files']} if prev_manifest else {}
+
+            manifest = {'source': src_dir, 'dirs': [], 'files': [], 'symlinks': []}
+            if dirty is None or prev_manifest is None:
+                written = self._scan(src_dir, src_dir, prev_files, manifest)
+            else:
+                written = self._apply_dirty(src_dir, dirty, prev_manifest, prev_files, manifest)
+            self.save_manifest(name, manifest)
+            return written, manifest
+
+    def _apply_dirty(self, src_dir, dirty, prev_manifest, prev_files, manifest):
+        touched = {os.path.dirname(p) or '.' for p in dirty}
+        for kind in ('dirs', 'files', 'symlinks'):
+            manifest[kind] = [e for e in prev_manifest[kind]
+                              if e['path'] == '.' or not is_under(e['path'], dirty)]
+        for d in manifest['dirs']:
+            if d['path'] in touched and os.path.isdir(os.path.join(src_dir, d['path'])):
+                st = os.stat(os.path.join(src_dir, d['path']))
+                d['mode'], d['mtime_ns'] = st.st_mode, st.st_mtime_ns
+        written = 0
+        for rel in sorted(dirty):
+            if is_under(os.path.dirname(rel), dirty):
+                continue
+            full = os.path.join(src_dir, rel)
+            if not os.path.lexists(full):
+                continue
+            if os.path.isdir(full) and not os.path.islink(full):
+                written += self._scan(src_dir, full, prev_files, manifest)
+            else:
+                written += self._add_file(full, rel, prev_files, manifest)
+        for kind in ('dirs', 'files', 'symlinks'):
+            manifest[kind].sort(key=lambda e: e['path'])
+        return written
+
+    def _check_chunk(self, cid):
+        try:
+            return 'ok' if chunk_id(self.get_chunk(cid)) == cid else 'hash'
+        except FileNotFoundError:
+            return 'missing'
+        except zlib.error:
+            return 'hash'
+
+    def verify(self, name, jobs=1, checked=None):
+        """Проверяет куски снимка: каждый должен быть на месте и совпадать со своим
+        хешем-именем. Кусок, общий для нескольких файлов или снимков, читается один
+        раз (checked - словарь cid -> результат, общий для нескольких вызовов).
+        Возвращает список (статус, path) для файлов с повреждёнными кусками."""
+        files = self.load_manifest(name)['files']
+        checked = {} if checked is None else checked
+        todo = sorted({cid for e in files for cid in e['chunks']} - checked.keys())
+        with ThreadPoolExecutor(max(1, jobs)) as pool:
+            checked.update(zip(todo, pool.map(self._check_chunk, todo)))
+        problems = []
+        for e in files:
+            bad = [checked[cid] for cid in e['chunks'] if checked[cid] != 'ok']
+            if bad:
+                problems.append(('missing' if 'missing' in bad else 'hash', e['path']))
+        return problems
+
+    def _restore_file(self, e, dest):
+        target = os.path.join(dest, e['path'])
+        with open(target, 'wb') as f:
+            for cid in e['chunks']:
+                f.write(self.get_chunk(cid))
+        os.chmod(target, e['mode'] & 0o7777)
+        os.utime(target, ns=(e['mtime_ns'], e['mtime_ns']))
+
+    def restore(self, name, dest, prefix='', jobs=1):
+        """Восстанавливает снимок (или его подкаталог/файл prefix) в каталог dest."""
+        manifest = self.load_manifest(name)
+        prefix = os.path.normpath(prefix) if prefix else ''
+
+        def wanted(path):
+            return not prefix or path == prefix or path.startswith(prefix + os.sep)
+
+        for d in manifest['dirs']:
+            if wanted(d['path']) or prefix.startswith(d['path'] + os.sep) or d['path'] == '.':
+                os.makedirs(os.path.join(dest, d['path']), exist_ok=True)
+        files = [e for e in manifest['files'] if wanted(e['path'])]
+        for e in files:
+            os.makedirs(os.path.dirname(os.path.join(dest, e['path'])), exist_ok=True)
+        with ThreadPoolExecutor(max(1, jobs)) as pool:
+            for fut in [pool.submit(self._restore_file, e, dest) for e in files]:
+                fut.result()
+        for s in manifest['symlinks']:
+            if not wanted(s['path']):
+                continue
+            target = os.path.join(dest, s['path'])
+            if os.path.lexists(target):
+                os.unlink(target)
+            os.symlink(s['target'], target)
+        # время каталогов выставляем в конце, т.к. создание файлов его меняет
+        for d in reversed(manifest['dirs']):
+            if wanted(d['path']):
+                target = os.path.join(dest, d['path'])
+                os.chmod(target, d['mode'] & 0o7777)
+                os.utime(target, ns=(d['mtime_ns'], d['mtime_ns']))
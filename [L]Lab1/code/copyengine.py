@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Параллельное копирование файлов без прохода данных через user space.
+
+Порядок попыток: reflink (ioctl FICLONE, btrfs/xfs), os.copy_file_range,
+os.sendfile, и только потом обычный буферный copyfileobj.
+Метаданные переносятся shutil.copystat, как это делает copy2/copytree.
+"""
+import os
+import stat
+import errno
+import fcntl
+import shutil
+import functools
+import threading
+import delta
+from concurrent.futures import ThreadPoolExecutor
+
+FICLONE = 0x40049409
+CHUNK = 64 * 1024 * 1024
+# с ограничением скорости копируем мелкими порциями, чтобы не было всплесков
+THROTTLED_CHUNK = 1024 * 1024
+# ошибки, после которых надо пробовать следующий способ, а не падать
+FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                   errno.ENOTSUP, errno.ETXTBSY, errno.EBADF}
+
+
+def _reflink(fsrc, fdst):
+    try:
+        fcntl.ioctl(fdst, FICLONE, fsrc)
+        return True
+    except OSError:
+        return False
+
+
+def _kernel_copy(copy, fsrc, fdst, offset, size, limiter=None):
+    chunk = THROTTLED_CHUNK if limiter else CHUNK
+    while offset < size:
+        n = copy(fsrc, fdst, offset, min(chunk, size - offset))
+        if n == 0:
+            break
+        offset += n
+        if limiter:
+            limiter.bytes(n)
+    return offset
+
+
+def copy_data(src, dst, limiter=None):
+    """Копирует содержимое src в dst. Возвращает способ, которым это удалось.
+    limiter (throttle.Limiter) ограничивает скорость; reflink данные не переносит
+    и поэтому не ограничивается."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        ifd, ofd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(ifd).st_size
+        if size and _reflink(ifd, ofd):
+            return 'reflink'
+        offset = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                offset = _kernel_copy(lambda i, o, off, n: os.copy_file_range(i, o, n),
+                                      ifd, ofd, offset, size, limiter)
+                if offset >= size:
+                    return 'copy_file_range'
+            except OSError as e:
+                if e.errno not in FALLBACK_ERRNOS:
+                    raise
+            # copy_file_range без явных смещений двигает позиции обоих файлов
+            offset = os.lseek(ifd, 0, os.SEEK_CUR)
+            os.lseek(ofd, offset, os.SEEK_SET)
+        try:
+            offset = _kernel_copy(lambda i, o, off, n: os.sendfile(o, i, off, n),
+                                  ifd, ofd, offset, size, limiter)
+            if offset >= size:
+                return 'sendfile'
+        except OSError as e:
+            if e.errno not in FALLBACK_ERRNOS:
+                raise
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        while True:
+            data = fsrc.read(THROTTLED_CHUNK)
+            if not data:
+                break
+            fdst.write(data)
+            if limiter:
+                limiter.bytes(len(data))
+        return 'read/write'
+
+
+def copy_file(src, dst, limiter=None):
+    copy_data(src, dst, limiter)
+    shutil.copystat(src, dst)
+    return dst
+
+
+class CopyEngine:
+    """copy_function для copytree, раздающая копирование файлов пулу потоков.
+
+    Файл-приёмник создаётся сразу в вызывающем потоке: так копирование
+    содержимого не меняет mtime каталогов, который copytree уже выставил.
+    После copytree нужно вызвать wait().
+    """
+    def __init__(self, workers=1, stats=None, limiter=None):
+        self.workers = max(1, workers)
+        self.stats = stats
+        self.limiter = limiter
+        self.pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+        self.slots = threading.BoundedSemaphore(self.workers * 4)
+        self.lock = threading.Lock()
+        self.errors = []
+
+    def _done(self, src, dst, fut):
+        self.slots.release()
+        if fut.exception():
+            # недокопированный файл не должен попасть в снимок
+            try:
+                os.unlink(dst)
+            except OSError:
+                pass
+            with self.lock:
+                self.errors.append((src, dst, str(fut.exception())))
+
+    def _copy(self, src, dst, base=None):
+        reused = 0
+        if base:
+            written, reused = delta.delta_copy(src, base, dst, limiter=self.limiter)
+            shutil.copystat(src, dst)
+        else:
+            copy_file(src, dst, self.limiter)
+            written = os.stat(dst).st_size
+        if self.stats:
+            self.stats.add('files_copied')
+            self.stats.add('bytes_written', written)
+            if reused:
+                self.stats.add('bytes_reused', reused)
+        return dst
+
+    def copy(self, src, dst, base=None):
+        """base - предыдущая версия файла: тогда копируется дельта (delta.delta_copy)."""
+        # open() на FIFO без писателя повис бы навсегда; как shutil.copyfile,
+        # сразу отказываемся копировать всё, кроме обычных файлов
+        if not stat.S_ISREG(os.stat(src).st_mode):
+            raise shutil.SpecialFileError(f'`{src}` is not a regular file')
+        if self.limiter:
+            self.limiter.file()
+        if not self.pool:
+            return self._copy(src, dst, base)
+        open(dst, 'wb').close()
+        self.slots.acquire()
+        self.pool.submit(self._copy, src, dst, base).add_done_callback(
+            functools.partial(self._done, src, dst))
+        return dst
+
+    def wait(self):
+        """Дожидается всех копий; ошибки по отдельным файлам поднимаются одним
+        shutil.Error со списком (src, dst, причина), как у copytree."""
+        if self.pool:
+            self.pool.shutdown(wait=True)
+        errors, self.errors = self.errors, []
+        if errors:
+            raise shutil.Error(errors)
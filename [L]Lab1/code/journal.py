@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Журнал изменений каталога-источника на основе inotify.
+
+Рекурсивные inotify-наблюдения помечают изменённые пути (относительно source)
+как "грязные", и демон на следующем цикле обрабатывает только их.
+Журнал дублируется в файл, чтобы необработанные изменения не терялись,
+если цикл резервного копирования завершился ошибкой или демон перезапустили.
+Штатная остановка дописывает в файл метку CLEAN с путём source: только такой
+журнал после перезапуска принимается как есть. Без метки (сбой, kill -9) часть
+событий могла не дойти до файла, и первый цикл делает полный обход.
+"""
+import os
+import errno
+import ctypes
+import select
+import struct
+import threading
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+              | IN_ONLYDIR | IN_DONT_FOLLOW)
+EVENT = struct.Struct('iIII')
+RESCAN = '!rescan'
+CLEAN = '!clean '
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+class ChangeJournal:
+    def __init__(self, source, journal_file):
+        self.source = os.path.normpath(source)
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+        self.dirty = {}       # rel path -> номер события
+        self.rescan = 0       # номер события, после которого нужен полный обход (0 - не нужен)
+        self.seq = 0
+        self.wd_paths = {}
+        self.fd = -1
+        self.unsaved = []
+        self.stopped = False
+        self.thread = None
+        self._load()
+
+    def _load(self):
+        self.seq = 1
+        try:
+            with open(self.journal_file, encoding='utf-8') as f:
+                lines = [line.rstrip('\n') for line in f]
+        except FileNotFoundError:
+            lines = []
+        # доверяем только журналу, закрытому штатно и для того же source
+        if not lines or lines[-1] != CLEAN + self.source or RESCAN in lines:
+            self.rescan = 1
+        for line in lines:
+            if line and not line.startswith('!'):
+                self.dirty[line] = self.seq
+
+    def start(self):
+        fd = _libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.fd = fd
+        self._watch_tree(self.source)
+        # метка штатной остановки снимается: до следующей остановки журнал не закрыт
+        self._save()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _add_watch(self, path):
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            # чаще всего ENOSPC - кончился fs.inotify.max_user_watches
+            raise OSError(err, f'inotify_add_watch {path}')
+        self.wd_paths[wd] = path
+        return wd
+
+    def _still_watched(self, wd, path):
+        """path по-прежнему тот же каталог, за которым следит wd (повторный
+        inotify_add_watch для того же inode возвращает тот же wd)."""
+        try:
+            return self._add_watch(path) == wd
+        except OSError:
+            self._mark(RESCAN)
+            return True
+
+    def _watch_tree(self, top):
+        try:
+            self._add_watch(top)
+            for root, dirs, _ in os.walk(top):
+                for d in dirs:
+                    self._add_watch(os.path.join(root, d))
+        except OSError:
+            self._mark(RESCAN)
+
+    def _rel(self, path):
+        rel = os.path.relpath(path, self.source)
+        return '' if rel == '.' else rel
+
+    def _mark(self, rel):
+        with self.lock:
+            self.seq += 1
+            if rel == RESCAN:
+                self.rescan = self.seq
+            else:
+                self.dirty[rel] = self.seq
+        self.unsaved.append(rel + '\n')
+
+    def _flush(self):
+        if not self.unsaved:
+            return
+        lines, self.unsaved = self.unsaved, []
+        try:
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+        except OSError:
+            pass
+
+    def stop(self):
+        """Штатная остановка: дожидается потока inotify и закрывает журнал меткой."""
+        self.stopped = True
+        if self.thread:
+            self.thread.join(2)
+            if self.thread.is_alive():
+                return
+        self._flush()
+        self._save(clean=True)
+
+    def _run(self):
+        while not self.stopped:
+            try:
+                if not select.select([self.fd], [], [], 1.0)[0]:
+                    continue
+                data = os.read(self.fd, 64 * 1024)
+            except InterruptedError:
+                continue
+            pos = 0
+            while pos < len(data):
+                wd, mask, _cookie, length = EVENT.unpack_from(data, pos)
+                name = data[pos + EVENT.size:pos + EVENT.size + length].rstrip(b'\0')
+                pos += EVENT.size + length
+                self._handle(wd, mask, os.fsdecode(name))
+            self._flush()
+        os.close(self.fd)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self._mark(RESCAN)
+            return
+        base = self.wd_paths.get(wd)
+        if mask & IN_IGNORED:
+            self.wd_paths.pop(wd, None)
+            return
+        if base is None or mask & IN_DELETE_SELF:
+            return
+        if mask & IN_MOVE_SELF:
+            # при переименовании внутри source IN_MOVED_TO уже перевесил это же
+            # наблюдение на новый путь; снимаем его, только если каталог уехал наружу
+            if base != self.source and not self._still_watched(wd, base):
+                _libc.inotify_rm_watch(self.fd, wd)
+            return
+        path = os.path.join(base, name) if name else base
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self._watch_tree(path)
+        rel = self._rel(path)
+        if rel:
+            self._mark(rel)
+
+    def take(self):
+        """Возвращает (seq, множество грязных путей) или (seq, None), если нужен полный обход."""
+        with self.lock:
+            if self.rescan:
+                return self.seq, None
+            return self.seq, set(self.dirty)
+
+    def retry(self, paths):
+        """Снова помечает пути source, которые не удалось скопировать. Битые ссылки,
+        FIFO и прочие необычные файлы не помечаются: их не скопировать и потом."""
+        for path in paths:
+            rel = self._rel(path)
+            if rel and not rel.startswith('..') and (os.path.isfile(path) or os.path.isdir(path)):
+                self._mark(rel)
+        self._flush()
+
+    def commit(self, seq):
+        """Снимок, учитывающий изменения до seq включительно, успешно создан."""
+        with self.lock:
+            if self.rescan and self.rescan <= seq:
+                self.rescan = 0
+            self.dirty = {p: s for p, s in self.dirty.items() if s > seq}
+        self._save()
+
+    def _save(self, clean=False):
+        """Переписывает файл журнала текущим состоянием."""
+        with self.lock:
+            pending = list(self.dirty)
+            if self.rescan:
+                pending.append(RESCAN)
+            if clean:
+                pending.append(CLEAN + self.source)
+            tmp = self.journal_file + '.tmp'
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.writelines(p + '\n' for p in pending)
+                os.replace(tmp, self.journal_file)
+            except OSError:
+                pass
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Компактный манифест снимка: <backup>/.manifests/<timestamp>.jsonl.
+
+Одна строка на файл - JSON-массив [path, size, mtime_ns, blake2b],
+строки отсортированы по path. Благодаря сортировке поиск пути - это
+двоичный поиск по смещениям в файле, а diff - слияние двух потоков.
+"""
+import os
+import json
+import hashlib
+from chunkstore import is_under
+
+DIR_NAME = '.manifests'
+HASH_SIZE = 16
+
+
+def manifests_dir(dst_dir):
+    return os.path.join(dst_dir, DIR_NAME)
+
+
+def manifest_path(dst_dir, name):
+    return os.path.join(manifests_dir(dst_dir), name + '.jsonl')
+
+
+def file_hash(path, limiter=None):
+    h = hashlib.blake2b(digest_size=HASH_SIZE)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            if limiter:
+                limiter.bytes(len(data))
+            h.update(data)
+    return h.hexdigest()
+
+
+def write(dst_dir, name, entries):
+    os.makedirs(manifests_dir(dst_dir), exist_ok=True)
+    path = manifest_path(dst_dir, name)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for e in sorted(entries, key=lambda e: e[0]):
+            f.write(json.dumps(e, ensure_ascii=False) + '\n')
+    os.replace(tmp, path)
+
+
+def names(dst_dir):
+    try:
+        files = os.listdir(manifests_dir(dst_dir))
+    except FileNotFoundError:
+        return []
+    return sorted(n[:-6] for n in files if n.endswith('.jsonl'))
+
+
+def remove(dst_dir, name):
+    try:
+        os.unlink(manifest_path(dst_dir, name))
+    except FileNotFoundError:
+        pass
+
+
+def iter_entries(dst_dir, name):
+    try:
+        with open(manifest_path(dst_dir, name), encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+    except FileNotFoundError:
+        return
+
+
+def load(dst_dir, name):
+    """path -> [path, size, mtime_ns, hash]"""
+    return {e[0]: e for e in iter_entries(dst_dir, name)}
+
+
+def _seek_first(f, key):
+    """Переходит к первой строке, чей path >= key (двоичный поиск по байтам файла)."""
+    lo, hi = 0, os.fstat(f.fileno()).st_size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(max(mid - 1, 0))
+        if mid:
+            f.readline()
+        start = f.tell()
+        line = f.readline()
+        if line and json.loads(line)[0] < key:
+            lo = start + len(line)
+        else:
+            hi = mid
+    f.seek(lo)
+
+
+def lookup(dst_dir, name, path):
+    try:
+        with open(manifest_path(dst_dir, name), 'rb') as f:
+            _seek_first(f, path)
+            line = f.readline()
+    except FileNotFoundError:
+        return None
+    if line:
+        e = json.loads(line)
+        if e[0] == path:
+            return e
+    return None
+
+
+def iter_prefix(dst_dir, name, prefix):
+    """Все записи с путём prefix или внутри каталога prefix ('' - все)."""
+    prefix = '' if prefix in ('', '.') else prefix.strip('/')
+    try:
+        f = open(manifest_path(dst_dir, name), 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        if prefix:
+            _seek_first(f, prefix)
+        for line in f:
+            e = json.loads(line)
+            if prefix and not (e[0] == prefix or e[0].startswith(prefix + '/')):
+                # между 'a/b' и 'a/b/...' могут стоять 'a/b-x', 'a/b.txt' и т.п.
+                if e[0] > prefix + '/':
+                    break
+                continue
+            yield e
+
+
+def diff(dst_dir, a, b):
+    """Слияние двух отсортированных манифестов: ('+'|'-'|'M', path, old, new)."""
+    ia, ib = iter_entries(dst_dir, a), iter_entries(dst_dir, b)
+    ea, eb = next(ia, None), next(ib, None)
+    while ea or eb:
+        if eb is None or (ea and ea[0] < eb[0]):
+            yield '-', ea[0], ea, None
+            ea = next(ia, None)
+        elif ea is None or eb[0] < ea[0]:
+            yield '+', eb[0], None, eb
+            eb = next(ib, None)
+        else:
+            if ea[1:] != eb[1:]:
+                yield 'M', ea[0], ea, eb
+            ea, eb = next(ia, None), next(ib, None)
+
+
+def scan_tree(root, prev=None, dirty=None, cache=None, limiter=None):
+    """Записи манифеста для снимка-каталога root. Хеш берётся из prev (манифест
+    предыдущего снимка), если размер и mtime совпали, затем из cache
+    (checksum.ChecksumCache); иначе файл читается с тем же ограничением
+    скорости limiter, что и копирование.
+    С dirty просматриваются только изменённые пути, остальное берётся из prev."""
+    prev = prev or {}
+    entries = []
+    tops = [root]
+    if dirty is not None:
+        entries = [e for e in prev.values() if not is_under(e[0], dirty)]
+        tops = [os.path.join(root, p) for p in sorted(dirty) if not is_under(os.path.dirname(p), dirty)]
+    for top in tops:
+        if os.path.isfile(top):
+            walk = [(os.path.dirname(top), [], [os.path.basename(top)])]
+        else:
+            walk = os.walk(top)
+        for d, _, files in walk:
+            for fn in files:
+                full = os.path.join(d, fn)
+                rel = os.path.relpath(full, root)
+                try:
+                    st = os.stat(full)
+                except FileNotFoundError:
+                    continue
+                old = prev.get(rel)
+                if old and old[1] == st.st_size and old[2] == st.st_mtime_ns:
+                    entries.append([rel, st.st_size, st.st_mtime_ns, old[3]])
+                else:
+                    h = cache.hash_file(full, st, limiter) if cache else file_hash(full, limiter)
+                    entries.append([rel, st.st_size, st.st_mtime_ns, h])
+    return entries
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Политика хранения снимков: keep_last / keep_hourly / keep_daily / keep_weekly.
+
+Для каждого правила снимки перебираются от новых к старым, и в каждом
+часе/дне/неделе оставляется самый новый снимок, пока не набрано N интервалов.
+Снимок сохраняется, если его оставило хотя бы одно правило.
+"""
+import datetime as dt
+
+TIME_FORMAT = '%Y%m%d_%H%M%S'
+
+BUCKETS = {
+    'keep_hourly': lambda t: t.strftime('%Y%m%d%H'),
+    'keep_daily': lambda t: t.strftime('%Y%m%d'),
+    'keep_weekly': lambda t: t.isocalendar()[:2],
+}
+
+
+def enabled(policy):
+    return any(policy.get(k, 0) > 0 for k in ('keep_last', *BUCKETS))
+
+
+def select(names, policy):
+    """Возвращает (оставить, удалить) для списка имён снимков."""
+    ordered = sorted(names, reverse=True)
+    if not enabled(policy):
+        return ordered, []
+    # самый новый снимок нужен всегда: от него строится следующий инкремент
+    keep = set(ordered[:max(1, policy.get('keep_last', 0))])
+    for key, bucket_of in BUCKETS.items():
+        limit = policy.get(key, 0)
+        seen = set()
+        for name in ordered:
+            if len(seen) >= limit:
+                break
+            bucket = bucket_of(dt.datetime.strptime(name, TIME_FORMAT))
+            if bucket not in seen:
+                seen.add(bucket)
+                keep.add(name)
+    return ([n for n in ordered if n in keep],
+            [n for n in ordered if n not in keep])
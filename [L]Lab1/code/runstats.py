@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Метрики запусков резервного копирования.
+
+Каждый цикл пишет одну JSON-строку в <backup>/.stats.jsonl; файл обрезается
+до последних MAX_RUNS записей, когда вырастает вдвое.
+"""
+import os
+import json
+import time
+import threading
+
+FILE_NAME = '.stats.jsonl'
+MAX_RUNS = 1000
+COUNTERS = ('files_scanned', 'files_copied', 'files_linked', 'bytes_written', 'bytes_reused',
+            'errors')
+
+
+def stats_path(dst_dir):
+    return os.path.join(dst_dir, FILE_NAME)
+
+
+class RunStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started = time.time()
+        self._t0 = time.monotonic()
+
+    def add(self, key, n=1):
+        with self.lock:
+            self.counters[key] += n
+
+    def finish(self, **extra):
+        duration = time.monotonic() - self._t0
+        run = {'start': round(self.started, 3), 'duration': round(duration, 3), **self.counters}
+        run['throughput'] = round(run['bytes_written'] / duration) if duration > 0 else 0
+        run.update(extra)
+        return run
+
+
+def record(dst_dir, run):
+    path = stats_path(dst_dir)
+    try:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(run) + '\n')
+        if os.path.getsize(path) > 2 * MAX_RUNS * 256:
+            runs = load(dst_dir)
+            if len(runs) > MAX_RUNS:
+                tmp = path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.writelines(json.dumps(r) + '\n' for r in runs[-MAX_RUNS:])
+                os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def load(dst_dir, last=None):
+    runs = []
+    try:
+        with open(stats_path(dst_dir), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    runs.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return runs[-last:] if last else runs
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Проверки репозитория кусков: нарезка content-defined chunking сверяется
+с побайтовым определением границы, сдвиг данных не меняет последующие куски,
+снимок восстанавливается без потерь, исчезнувший файл пропускается.
+Запуск: python -m unittest test_chunkstore
+"""
+import io
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import chunkstore
+
+
+def reference_cut(buf):
+    """cut_point по определению: позиция за первым байтом i, где хеши окон,
+    кончающихся на i, i-WINDOW и i-2*WINDOW, совпали с CUT_MAGIC по маскам."""
+    n = min(len(buf), chunkstore.MAX_CHUNK)
+    if n <= chunkstore.MIN_CHUNK:
+        return n
+    w = chunkstore.WINDOW
+    h = [0] * n
+    for i in range(n):
+        v = 0
+        for j in range(max(0, i - w + 1), i + 1):
+            v ^= chunkstore.TABLE[buf[j]]
+        h[i] = v
+    for i in range(chunkstore.MIN_CHUNK, n):
+        if all(h[i - k * w] & mask == magic
+               for k, (magic, mask) in enumerate(zip(chunkstore.CUT_MAGIC, chunkstore.CUT_MASKS))):
+            return i + 1
+    return n
+
+
+# маленькие куски и частые границы, чтобы побайтовая проверка шла быстро
+SMALL = {'MIN_CHUNK': 1024, 'MAX_CHUNK': 16 * 1024, 'SCAN_BLOCK': 1000,
+         'CUT_MAGIC': (0x0a, 0x03, 0x01), 'CUT_MASKS': (0x0f, 0x0f, 0x03)}
+
+
+class ChunkerTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(7)
+
+    def test_cut_point_matches_definition(self):
+        with mock.patch.multiple(chunkstore, **SMALL):
+            for size in (0, 100, 1024, 1025, 3000, 16 * 1024, 40000):
+                for _ in range(5):
+                    buf = self.rng.randbytes(size)
+                    self.assertEqual(chunkstore.cut_point(buf), reference_cut(buf), size)
+            # низкая энтропия: много одинаковых окон подряд
+            buf = bytes(self.rng.choice(b'ab') for _ in range(20000))
+            self.assertEqual(chunkstore.cut_point(buf), reference_cut(buf))
+
+    def test_chunks_cover_data_within_limits(self):
+        data = self.rng.randbytes(16 * 1024 * 1024)
+        chunks = list(chunkstore.iter_chunks(io.BytesIO(data)))
+        self.assertEqual(b''.join(chunks), data)
+        self.assertGreater(len(chunks), 2)
+        for c in chunks[:-1]:
+            self.assertGreater(len(c), chunkstore.MIN_CHUNK)
+            self.assertLessEqual(len(c), chunkstore.MAX_CHUNK)
+
+    def test_insert_keeps_later_chunks(self):
+        data = self.rng.randbytes(16 * 1024 * 1024)
+        before = [chunkstore.chunk_id(c) for c in chunkstore.iter_chunks(io.BytesIO(data))]
+        shifted = data[:1000] + b'inserted' + data[1000:]
+        after = [chunkstore.chunk_id(c) for c in chunkstore.iter_chunks(io.BytesIO(shifted))]
+        # вставка задевает только кусок, в который попала
+        self.assertEqual(before[1:], after[1:])
+        self.assertNotEqual(before[0], after[0])
+
+
+class RepositoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        os.makedirs(os.path.join(self.src, 'sub'))
+        self.repo = chunkstore.Repository(os.path.join(self.tmp.name, 'repo'))
+        rng = random.Random(3)
+        self.files = {'a': rng.randbytes(3 * 1024 * 1024), 'sub/b': b'small', 'empty': b''}
+        for rel, data in self.files.items():
+            with open(os.path.join(self.src, rel), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_backup_restore_and_dedup(self):
+        written, _ = self.repo.backup(self.src, '20250101_000000')
+        self.assertGreater(written, 0)
+        again, _ = self.repo.backup(self.src, '20250101_000100')
+        self.assertEqual(again, 0)
+        dest = os.path.join(self.tmp.name, 'out')
+        self.repo.restore('20250101_000100', dest)
+        for rel, data in self.files.items():
+            with open(os.path.join(dest, rel), 'rb') as f:
+                self.assertEqual(f.read(), data, rel)
+
+    def test_vanished_file_is_skipped(self):
+        store = self.repo._store_file
+
+        def vanish(full, *args):
+            if full.endswith('sub/b'):
+                os.unlink(full)
+            return store(full, *args)
+
+        with mock.patch.object(self.repo, '_store_file', side_effect=vanish):
+            _, manifest = self.repo.backup(self.src, '20250101_000000')
+        self.assertEqual(sorted(e['path'] for e in manifest['files']), ['a', 'empty'])
+
+
+if __name__ == '__main__':
+    unittest.main()
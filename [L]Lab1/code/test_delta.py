@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Проверки delta_copy: результат побайтно равен src при любых правках
+относительно base, а совпадающие блоки действительно берутся из base.
+Запуск: python -m unittest test_delta
+"""
+import os
+import errno
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import delta
+
+BLOCK = 256
+
+
+class DeltaCopyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rng = random.Random(42)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name, data=None):
+        p = os.path.join(self.tmp.name, name)
+        if data is not None:
+            with open(p, 'wb') as f:
+                f.write(data)
+        return p
+
+    def roundtrip(self, base, new, block=BLOCK):
+        src, old, dst = self.path('src', new), self.path('base', base), self.path('dst')
+        written, reused = delta.delta_copy(src, old, dst, block)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), new)
+        self.assertEqual(written + reused, len(new))
+        return written, reused
+
+    def blob(self, n):
+        return self.rng.randbytes(n)
+
+    def test_identical(self):
+        data = self.blob(50 * BLOCK + 17)
+        written, reused = self.roundtrip(data, data)
+        self.assertEqual(written, 0)
+
+    def test_edit_in_place(self):
+        base = self.blob(40 * BLOCK)
+        new = bytearray(base)
+        for off in (0, 7 * BLOCK + 3, 39 * BLOCK + 1):
+            new[off:off + 10] = self.blob(10)
+        written, _ = self.roundtrip(base, bytes(new))
+        self.assertLessEqual(written, 3 * BLOCK)
+
+    def test_insert_and_delete_shift_data(self):
+        base = self.blob(40 * BLOCK)
+        new = base[:5 * BLOCK + 11] + self.blob(100) + base[5 * BLOCK + 11:20 * BLOCK] + base[21 * BLOCK + 5:]
+        written, _ = self.roundtrip(base, new)
+        # после сдвига блоки base снова находятся поиском
+        self.assertLess(written, 6 * BLOCK)
+
+    def test_grow_shrink_and_empty(self):
+        base = self.blob(10 * BLOCK + 100)
+        self.roundtrip(base, base + self.blob(3 * BLOCK + 1))
+        self.roundtrip(base, base[:4 * BLOCK - 9])
+        self.roundtrip(base, b'')
+        self.roundtrip(b'', base)
+        self.roundtrip(b'', b'')
+
+    def test_unrelated_and_random_edits(self):
+        self.roundtrip(self.blob(20 * BLOCK), self.blob(25 * BLOCK))
+        for _ in range(30):
+            data = bytearray(self.blob(self.rng.randint(0, 30 * BLOCK)))
+            base = bytes(data)
+            for _ in range(self.rng.randint(0, 5)):
+                at = self.rng.randint(0, len(data))
+                if self.rng.random() < 0.5:
+                    data[at:at] = self.blob(self.rng.randint(1, 2 * BLOCK))
+                else:
+                    del data[at:at + self.rng.randint(1, 2 * BLOCK)]
+            self.roundtrip(base, bytes(data))
+
+    def test_without_copy_file_range(self):
+        base = self.blob(30 * BLOCK)
+        new = base[:10 * BLOCK] + self.blob(50) + base[10 * BLOCK:]
+        # ФС без copy_file_range между этими файлами: блоки копируются через pread/pwrite
+        with mock.patch.object(delta.os, 'copy_file_range', create=True,
+                               side_effect=OSError(errno.EXDEV, 'cross-device')) as cfr:
+            self.roundtrip(base, new)
+        self.assertEqual(cfr.call_count, 1)
+
+    def test_source_shrinks(self):
+        p = self.path('src', self.blob(4 * BLOCK))
+        with open(p, 'rb') as f:
+            src = delta._Source(f.fileno(), 8 * BLOCK, BLOCK)
+            with self.assertRaises(OSError) as cm:
+                src.window(0, 8 * BLOCK)
+        self.assertEqual(cm.exception.errno, errno.EIO)
+
+
+if __name__ == '__main__':
+    unittest.main()
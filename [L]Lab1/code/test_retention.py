@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Проверки политики хранения и сборки мусора в репозитории кусков.
+Запуск: python -m unittest test_retention
+"""
+import os
+import random
+import tempfile
+import threading
+import unittest
+import datetime as dt
+
+import chunkstore
+import retention
+
+
+def names(*stamps):
+    return [dt.datetime(*s).strftime(retention.TIME_FORMAT) for s in stamps]
+
+
+class SelectTest(unittest.TestCase):
+    def setUp(self):
+        # каждые 20 минут за 3 недели, начиная с понедельника
+        t0 = dt.datetime(2025, 3, 3)
+        self.all = [(t0 + dt.timedelta(minutes=20 * i)).strftime(retention.TIME_FORMAT)
+                    for i in range(3 * 7 * 72)]
+
+    def test_disabled_keeps_everything(self):
+        keep, drop = retention.select(self.all, {'keep_last': 0, 'keep_daily': 0})
+        self.assertEqual(drop, [])
+        self.assertEqual(keep, sorted(self.all, reverse=True))
+
+    def test_keep_last(self):
+        keep, drop = retention.select(self.all, {'keep_last': 5})
+        self.assertEqual(keep, sorted(self.all)[-5:][::-1])
+        self.assertEqual(len(drop), len(self.all) - 5)
+
+    def test_newest_per_bucket(self):
+        keep, _ = retention.select(self.all, {'keep_hourly': 3, 'keep_daily': 2, 'keep_weekly': 2})
+        expected = set(names((2025, 3, 23, 23, 40), (2025, 3, 23, 22, 40), (2025, 3, 23, 21, 40),
+                             (2025, 3, 22, 23, 40), (2025, 3, 16, 23, 40)))
+        self.assertEqual(set(keep), expected)
+
+    def test_rules_union_and_newest_always_kept(self):
+        # keep_daily уже держит самый новый снимок дня, keep_last его не дублирует
+        sample = names((2025, 1, 1, 10), (2025, 1, 1, 12), (2025, 1, 2, 9), (2025, 1, 5, 8))
+        keep, drop = retention.select(sample, {'keep_last': 1, 'keep_daily': 2})
+        self.assertEqual(keep, names((2025, 1, 5, 8), (2025, 1, 2, 9)))
+        self.assertEqual(drop, names((2025, 1, 1, 12), (2025, 1, 1, 10)))
+        # правило без keep_last всё равно не удаляет самый новый снимок
+        keep, _ = retention.select(sample, {'keep_weekly': 1})
+        self.assertIn(names((2025, 1, 5, 8))[0], keep)
+
+    def test_partition(self):
+        rng = random.Random(5)
+        sample = rng.sample(self.all, 200)
+        keep, drop = retention.select(sample, {'keep_last': 3, 'keep_hourly': 10, 'keep_daily': 4})
+        self.assertEqual(sorted(keep + drop), sorted(sample))
+        self.assertFalse(set(keep) & set(drop))
+
+
+class GcTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        os.makedirs(self.src)
+        self.repo = chunkstore.Repository(os.path.join(self.tmp.name, 'repo'))
+        self.rng = random.Random(11)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, rel, data):
+        with open(os.path.join(self.src, rel), 'wb') as f:
+            f.write(data)
+
+    def age_chunks(self):
+        # gc не трогает куски моложе своего запуска
+        for root, _, files in os.walk(self.repo.chunks_dir):
+            for f in files:
+                os.utime(os.path.join(root, f), (0, 0))
+
+    def chunk_ids(self, manifest, path):
+        return next(e['chunks'] for e in manifest['files'] if e['path'] == path)
+
+    def test_keeps_referenced_chunks(self):
+        shared = self.rng.randbytes(2 * 1024 * 1024)
+        self.write('shared', shared)
+        self.write('old', self.rng.randbytes(300 * 1024))
+        _, first = self.repo.backup(self.src, '20250101_000000')
+        os.unlink(os.path.join(self.src, 'old'))
+        self.write('new', b'new file')
+        self.repo.backup(self.src, '20250102_000000')
+        self.repo.delete_snapshot('20250101_000000')
+        self.age_chunks()
+
+        removed, freed = self.repo.gc()
+        self.assertEqual(removed, len(self.chunk_ids(first, 'old')))
+        self.assertGreater(freed, 0)
+        for cid in self.chunk_ids(first, 'old'):
+            self.assertFalse(os.path.exists(self.repo.chunk_path(cid)))
+        self.assertEqual(self.repo.verify('20250102_000000'), [])
+        dest = os.path.join(self.tmp.name, 'out')
+        self.repo.restore('20250102_000000', dest)
+        with open(os.path.join(dest, 'shared'), 'rb') as f:
+            self.assertEqual(f.read(), shared)
+        self.assertEqual(self.repo.gc(), (0, 0))
+
+    def test_waits_for_running_backup(self):
+        # кусок идущего снимка ещё не в манифесте: gc ждёт, пока снимок снимет блокировку
+        self.repo.init()
+        cid, _ = self.repo.put_chunk(b'not yet in a manifest')
+        self.age_chunks()
+        done = threading.Event()
+        with self.repo.locked():
+            t = threading.Thread(target=lambda: (self.repo.gc(), done.set()))
+            t.start()
+            self.assertFalse(done.wait(0.3))
+            self.assertTrue(os.path.exists(self.repo.chunk_path(cid)))
+        t.join(5)
+        self.assertTrue(done.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
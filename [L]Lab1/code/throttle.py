@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Ограничение нагрузки резервного копирования на диски и CPU.
+
+Limiter - пара token bucket'ов (байт/с и файлов/с), которые вызываются
+из пути копирования; lower_priority() понижает nice и класс ввода-вывода.
+"""
+import os
+import time
+import ctypes
+import platform
+import threading
+
+# номер системного вызова ioprio_set по архитектурам
+IOPRIO_SET = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+# nice при запуске: lower_priority() считает от него, а не от текущего
+BASE_NICE = os.getpriority(os.PRIO_PROCESS, 0)
+SUFFIXES = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_size(value):
+    """'10M' -> 10485760; 0 или пустая строка - без ограничения."""
+    value = str(value).strip().lower()
+    if not value:
+        return 0
+    if value[-1] in SUFFIXES:
+        return int(float(value[:-1]) * SUFFIXES[value[-1]])
+    return int(value)
+
+
+class TokenBucket:
+    """Токены копятся со скоростью rate, но не больше burst. Потребление в долг
+    допускается: вызывающий поток просто спит, пока долг не погасится."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Limiter:
+    def __init__(self, bytes_per_sec=0, files_per_sec=0):
+        self.byte_bucket = TokenBucket(bytes_per_sec) if bytes_per_sec > 0 else None
+        self.file_bucket = TokenBucket(files_per_sec) if files_per_sec > 0 else None
+
+    def __bool__(self):
+        return bool(self.byte_bucket or self.file_bucket)
+
+    def bytes(self, n):
+        if self.byte_bucket and n:
+            self.byte_bucket.consume(n)
+
+    def file(self):
+        if self.file_bucket:
+            self.file_bucket.consume(1)
+
+
+def _threads():
+    # в Linux nice и класс ввода-вывода у каждого потока свои
+    try:
+        return [int(t) for t in os.listdir('/proc/self/task')]
+    except OSError:
+        return [0]
+
+
+def lower_priority(nice=0, ionice=''):
+    """nice - прибавка к nice, с которым процесс запущен; ionice - 'idle' или
+    'best-effort[:0-7]', пустая строка - класс по умолчанию. Применяется ко всем
+    уже запущенным потокам, поэтому повторный вызов (перечитывание конфига)
+    заменяет прежние значения, а не складывается с ними."""
+    errors = []
+    prio = 0
+    nr = IOPRIO_SET.get(platform.machine())
+    if ionice:
+        cls, _, level = ionice.partition(':')
+        if cls not in IOPRIO_CLASSES or nr is None:
+            errors.append(f'ionice: не поддерживается {ionice} на {platform.machine()}')
+            ionice = ''
+        else:
+            prio = (IOPRIO_CLASSES[cls] << IOPRIO_CLASS_SHIFT) | int(level or 0)
+    libc = ctypes.CDLL(None, use_errno=True)
+    for tid in _threads():
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, min(19, BASE_NICE + nice))
+        except OSError as e:
+            errors.append(f'nice: {e}')
+        if nr is not None and libc.syscall(nr, IOPRIO_WHO_PROCESS, tid, prio) < 0 and ionice:
+            errors.append(f'ionice: {os.strerror(ctypes.get_errno())}')
+    return sorted(set(errors))
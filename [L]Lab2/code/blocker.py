@@ -1,11 +1,33 @@
 #!/usr/bin/env python3
-import time, json
+import time, json, heapq, threading
 from pathlib import Path
+from radix import PrefixTrie, addr_int, parse_prefix, format_prefix
 
-blocked = {}          # ip -> expire_ts or None
-whitelist = set()
+# both accept single IPs and CIDR prefixes; lookups are longest-prefix matches
+blocked = PrefixTrie()    # prefix -> expire_ts (inf = permanent)
+whitelist = PrefixTrie()  # prefix -> 1.0
+PERMANENT = float("inf")
+# expiry schedule: (expire_ts, key, length) min-heap; entries whose prefix was
+# re-blocked or unblocked since are stale and skipped when they come up
+_expiry = []
+# the tries are changed from the packet path (expiry) and from command threads
+_lock = threading.Lock()
 global_lock_until = 0
 _whitelist_file = None
+_shared_lock = None   # multiprocessing.Value('d') with the lockdown end, shared by shards
+enforcer = None       # enforce.Enforcer mirroring this state into the kernel
+
+def set_enforcer(e):
+    """Attach a kernel backend and push the current state to it."""
+    global enforcer
+    enforcer = e
+    if e is None: return
+    for prefix in whitelist: e.allow(prefix)
+    for prefix, ttl in active_blocks().items():
+        e.block(prefix, None if ttl is None else max(1, int(ttl)))
+    now = _now()
+    end = _shared_lock.value if _shared_lock is not None else global_lock_until
+    if end > now: e.lockdown(int(end - now))
 
 def _now(): return time.time()
 
@@ -23,7 +45,11 @@ def load_whitelist(path: str):
                 except Exception:
                     continue
                 ip=obj.get("ip")
-                if ip: whitelist.add(ip)
+                if not ip: continue
+                try: key, n = parse_prefix(ip)
+                except ValueError: continue
+                if obj.get("cmd") == "unwhitelist": whitelist.delete_int(key, n)
+                else: whitelist.insert_int(key, n)
     except Exception:
         pass
 
@@ -36,30 +62,56 @@ def _append_whitelist_file(cmd: dict):
     except Exception:
         pass
 
+def _prefix(ip: str):
+    """(key, length, canonical text) of an IP or CIDR string, None if invalid."""
+    if not ip: return None
+    try: key, n = parse_prefix(ip)
+    except ValueError: return None
+    return key, n, format_prefix(key, n)
+
 def add_whitelist(ip: str) -> bool:
-    if not ip: return False
-    whitelist.add(ip)
-    _append_whitelist_file({"cmd":"whitelist","ip":ip,"time":int(_now())})
+    p = _prefix(ip)
+    if not p: return False
+    with _lock: whitelist.insert_int(p[0], p[1])
+    if enforcer: enforcer.allow(p[2])
+    _append_whitelist_file({"cmd":"whitelist","ip":p[2],"time":int(_now())})
     return True
 
 def remove_whitelist(ip: str) -> bool:
-    if not ip: return False
-    whitelist.discard(ip)
-    _append_whitelist_file({"cmd":"unwhitelist","ip":ip,"time":int(_now())})
+    p = _prefix(ip)
+    if not p: return False
+    with _lock: whitelist.delete_int(p[0], p[1])
+    if enforcer: enforcer.disallow(p[2])
+    _append_whitelist_file({"cmd":"unwhitelist","ip":p[2],"time":int(_now())})
     return True
 
 def is_whitelisted(ip: str) -> bool:
-    return ip in whitelist
+    a = addr_int(ip)
+    with _lock: return whitelist.lookup_int(a) is not None
+
+def share_lockdown(value):
+    """Keep the lockdown end in shared memory so every shard process sees it."""
+    global _shared_lock
+    _shared_lock = value
 
 def set_global_lockdown(duration: int):
     """Block everyone except whitelist for <duration> seconds."""
     global global_lock_until
     end = _now() + max(0, int(duration))
-    if end > global_lock_until:
+    if _shared_lock is not None:
+        with _shared_lock.get_lock():
+            if end <= _shared_lock.value: return
+            _shared_lock.value = end
+    elif end > global_lock_until:
         global_lock_until = end
+    else:
+        return
+    if enforcer: enforcer.lockdown(end - _now())
 
 def is_global_locked() -> bool:
     global global_lock_until
+    if _shared_lock is not None:
+        return _now() <= _shared_lock.value
     if global_lock_until <= 0: return False
     if _now() > global_lock_until:
         global_lock_until = 0
@@ -67,20 +119,68 @@ def is_global_locked() -> bool:
     return True
 
 def block_ip(ip: str, duration: int = 60) -> bool:
-    if not ip: return False
-    if is_whitelisted(ip): return False
-    expire = None if not duration or duration <= 0 else int(_now() + int(duration))
-    blocked[ip] = expire
+    """Blocks an IP or a CIDR prefix; duration <= 0 blocks permanently."""
+    p = _prefix(ip)
+    if not p: return False
+    # refuse only when a whitelist entry covers the whole prefix
+    permanent = not duration or duration <= 0
+    expire = PERMANENT if permanent else int(_now() + int(duration))
+    with _lock:
+        # any covering entry counts, not just the longest match: a broader
+        # whitelisted prefix may sit above a more specific one
+        if whitelist.covers_int(p[0], p[1]): return False
+        blocked.insert_int(p[0], p[1], expire)
+        if not permanent:
+            heapq.heappush(_expiry, (expire, p[0], p[1]))
+            # unblocks and re-blocks leave stale entries; rebuild before they dominate
+            if len(_expiry) > 2 * len(blocked) + 64: _rebuild_expiry()
+    if enforcer: enforcer.block(p[2], None if permanent else int(duration))
     return True
 
-def is_blocked(ip: str) -> bool:
-    if is_whitelisted(ip): return False
-    if is_global_locked(): return True
-    t = blocked.get(ip)
-    if not t: return False
-    if t is None: return True
-    if _now() > t:
-        try: del blocked[ip]
-        except KeyError: pass
-        return False
+def unblock_ip(ip: str) -> bool:
+    p = _prefix(ip)
+    if not p: return False
+    with _lock:
+        if blocked.delete_int(p[0], p[1]) is None: return False
+    if enforcer: enforcer.unblock(p[2])
     return True
+
+def _rebuild_expiry():
+    _expiry[:] = [(t, *parse_prefix(prefix)) for prefix, t in blocked.items() if t != PERMANENT]
+    heapq.heapify(_expiry)
+
+def expire_blocks(now: float | None = None) -> int:
+    """Drops every block whose deadline has passed; returns how many.
+    Costs one comparison when nothing is due."""
+    if not _expiry: return 0
+    if now is None: now = _now()
+    if _expiry[0][0] >= now: return 0
+    n = 0
+    with _lock:
+        while _expiry and _expiry[0][0] < now:
+            t, key, plen = heapq.heappop(_expiry)
+            if blocked.get_int(key, plen) == t:
+                blocked.delete_int(key, plen)
+                n += 1
+    return n
+
+def active_blocks() -> dict:
+    """prefix -> remaining seconds (None = permanent) for every live block."""
+    now = _now()
+    expire_blocks(now)
+    with _lock:
+        return {prefix: None if t == PERMANENT else t - now
+                for prefix, t in blocked.items() if t >= now}
+
+def stats() -> dict:
+    return {"blocked": len(blocked), "whitelist": len(whitelist), "expiry_heap": len(_expiry)}
+
+def is_blocked(ip: str) -> bool:
+    a = addr_int(ip)
+    now = _now()
+    expire_blocks(now)
+    with _lock:
+        if whitelist.lookup_int(a) is not None: return False
+        if is_global_locked(): return True
+        # everything past its deadline was dropped above
+        return blocked.lookup_int(a) is not None
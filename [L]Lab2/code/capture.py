@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""AF_PACKET capture without scapy.
+
+RingCapture maps a TPACKET_V3 receive ring: the kernel fills whole blocks
+of frames and hands each block over at once, so one poll() wakeup yields a
+batch of packets and no per-packet syscall or copy into Python is needed
+beyond the few header bytes parse_ipv4() reads. RecvCapture is the fallback
+when the ring cannot be set up: a non-blocking recv loop drained in batches.
+
+Only IPv4 frames are delivered (ETH_P_IP) for the default "ip" filter;
+any other --bpf expression is compiled with `tcpdump -ddd` if available.
+
+For sharded mode several RingCaptures join one PACKET_FANOUT group whose
+classic-BPF program hashes the source address, so the kernel itself sends
+every packet of a given source to the same worker.
+"""
+import ctypes, mmap, select, shutil, socket, struct, subprocess, sys, time
+from packets import parse_ipv4
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+SO_ATTACH_FILTER = 26
+PACKET_FANOUT = 18
+PACKET_FANOUT_DATA = 22
+PACKET_FANOUT_CBPF = 6
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+HEADER_BYTES = 64          # enough for an IPv4 header with options + L4 ports
+
+_REQ3 = struct.Struct("=7I")             # tpacket_req3
+_BLOCK = struct.Struct("=III")           # block_status, num_pkts, offset_to_first_pkt
+_BLOCK_OFF = 8                           # after version, offset_to_priv
+_PKT = struct.Struct("=IIIIIIHH")        # tpacket3_hdr up to tp_net
+_STATUS = struct.Struct("=I")
+_STATS3 = struct.Struct("=III")          # tp_packets, tp_drops, tp_freeze_q_cnt
+
+class _SockFilter(ctypes.Structure):
+    _fields_ = [("code", ctypes.c_uint16), ("jt", ctypes.c_uint8),
+                ("jf", ctypes.c_uint8), ("k", ctypes.c_uint32)]
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_uint16), ("filter", ctypes.POINTER(_SockFilter))]
+
+def _fprog(insns) -> bytes:
+    arr = (_SockFilter * len(insns))(*[_SockFilter(*i) for i in insns])
+    prog = _SockFprog(len(insns), arr)
+    # the kernel copies the program during setsockopt, arr only has to outlive the call
+    data = ctypes.string_at(ctypes.addressof(prog), ctypes.sizeof(prog))
+    return data, arr
+
+SKF_NET_OFF = -0x100000   # cBPF loads relative to the network header
+
+def src_hash_program():
+    """cBPF for PACKET_FANOUT_CBPF: A = (ip.src * golden ratio) >> 16;
+    the kernel takes the result modulo the number of group members.
+    Fanout runs before the link header is pushed back, hence SKF_NET_OFF."""
+    return [(0x20, 0, 0, (SKF_NET_OFF + 12) & 0xffffffff),  # ld  [ip.src]
+            (0x24, 0, 0, 0x9e3779b1),                       # mul #k
+            (0x74, 0, 0, 16),                               # rsh #16
+            (0x16, 0, 0, 0)]                                # ret a
+
+def _open_socket(iface: str, bpf: str):
+    """Returns (socket, ethertype to bind, whether bpf is enforced)."""
+    plain_ip = bpf.strip() in ("", "ip")
+    proto = ETH_P_IP if plain_ip else ETH_P_ALL
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(proto))
+    applied = plain_ip or attach_filter(sock, bpf)
+    return sock, proto, applied
+
+def attach_filter(sock, bpf: str) -> bool:
+    tcpdump = shutil.which("tcpdump")
+    if not tcpdump: return False
+    try:
+        out = subprocess.run([tcpdump, "-ddd", bpf], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    lines = out.split("\n")
+    n = int(lines[0])
+    data, _arr = _fprog([tuple(map(int, l.split())) for l in lines[1:n + 1]])
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, data)
+    return True
+
+class RingCapture:
+    def __init__(self, iface: str, bpf: str = "ip", block_size: int = 1 << 20,
+                 block_nr: int = 64, frame_size: int = 2048, timeout_ms: int = 100,
+                 fanout_group: int | None = None):
+        self.sock, proto, self.filtered = _open_socket(iface, bpf)
+        self.block_size, self.block_nr = block_size, block_nr
+        self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, _REQ3.pack(
+            block_size, block_nr, frame_size, block_size * block_nr // frame_size, timeout_ms, 0, 0))
+        self.ring = mmap.mmap(self.sock.fileno(), block_size * block_nr,
+                              mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.sock.bind((iface, proto))
+        if fanout_group is not None:
+            # the program can only be attached once the socket is in the group
+            self.sock.setsockopt(SOL_PACKET, PACKET_FANOUT, fanout_group | (PACKET_FANOUT_CBPF << 16))
+            data, _arr = _fprog(src_hash_program())
+            self.sock.setsockopt(SOL_PACKET, PACKET_FANOUT_DATA, data)
+        self.packets = self.drops = 0
+        self.running = True
+
+    def stats(self) -> dict:
+        # the kernel resets its counters on every read
+        got, dropped, _ = _STATS3.unpack(self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _STATS3.size))
+        self.packets += got; self.drops += dropped
+        return {"packets": self.packets, "drops": self.drops}
+
+    def batches(self):
+        """Yields one list of PacketInfo per ring block handed over by the kernel,
+        or an empty list after a second without traffic."""
+        ring, poller = self.ring, select.poll()
+        poller.register(self.sock, select.POLLIN | select.POLLERR)
+        i = 0
+        while self.running:
+            base = i * self.block_size
+            status, num, first = _BLOCK.unpack_from(ring, base + _BLOCK_OFF)
+            if not status & TP_STATUS_USER:
+                if not poller.poll(1000): yield []
+                continue
+            batch, p = [], base + first
+            for _ in range(num):
+                nxt, sec, nsec, snap, wire, _st, mac, net = _PKT.unpack_from(ring, p)
+                end = min(p + mac + snap, p + net + HEADER_BYTES)
+                pkt = parse_ipv4(ring[p + net:end], 0, sec + nsec * 1e-9, wire)
+                if pkt: batch.append(pkt)
+                p += nxt
+            _STATUS.pack_into(ring, base + _BLOCK_OFF, TP_STATUS_KERNEL)
+            i = (i + 1) % self.block_nr
+            yield batch
+
+    def close(self):
+        self.running = False
+        self.ring.close(); self.sock.close()
+
+class RecvCapture:
+    def __init__(self, iface: str, bpf: str = "ip", batch: int = 256):
+        self.sock, proto, self.filtered = _open_socket(iface, bpf)
+        self.sock.bind((iface, proto))
+        self.sock.setblocking(False)
+        self.batch = batch
+        self.running = True
+        self.packets = 0
+
+    def stats(self) -> dict:
+        return {"packets": self.packets, "drops": None}
+
+    def batches(self):
+        buf = bytearray(65536)
+        view = memoryview(buf)
+        while self.running:
+            select.select([self.sock], [], [], 1.0)
+            batch = []
+            while len(batch) < self.batch:
+                try:
+                    n, addr = self.sock.recvfrom_into(buf)
+                except BlockingIOError:
+                    break
+                # cooked link header: ethernet-like devices carry 14 bytes before IP
+                off = 14 if addr[3] in (1, 772) else 0
+                pkt = parse_ipv4(bytes(view[off:min(n, off + HEADER_BYTES)]), 0, time.time(), n)
+                if pkt: batch.append(pkt)
+            self.packets += len(batch)
+            yield batch
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+
+def open_capture(iface: str, bpf: str = "ip"):
+    try:
+        cap = RingCapture(iface, bpf)
+    except OSError as e:
+        print(f"[capture] TPACKET_V3 ring unavailable ({e}), using recv()", file=sys.stderr)
+        cap = RecvCapture(iface, bpf)
+    if not cap.filtered:
+        print(f"[capture] cannot compile BPF '{bpf}' without tcpdump, capturing all IPv4", file=sys.stderr)
+    return cap
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Command channels into a running detector.
+
+ControlServer: a Unix domain socket speaking newline-delimited JSON, one
+response line per request line, e.g.
+    {"cmd": "block", "ip": "10.0.0.0/16", "duration": 60}  ->  {"ok": true}
+    {"cmd": "stats"}                                     ->  {"ok": true, "stats": {...}}
+Commands take effect as soon as they are read, and the caller learns the result.
+
+CommandTail: the old commands.jsonl interface. The file is followed from a
+byte offset, so each line is read once, and reads are woken by inotify
+(polling is the fallback). Truncated or replaced files are read again
+from the start.
+"""
+import ctypes, json, os, select, socket, socketserver, struct, threading
+from pathlib import Path
+
+IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x2, 0x8, 0x80, 0x100
+IN_NONBLOCK, IN_CLOEXEC = os.O_NONBLOCK, os.O_CLOEXEC     # same values as the O_ flags
+_EVENT = struct.Struct("=iIII")     # inotify_event: wd, mask, cookie, len; then the name
+
+def send(path: str, cmd: dict, timeout: float = 1.0) -> dict:
+    """Client side: one request, one response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(str(path))
+        s.sendall((json.dumps(cmd) + "\n").encode())
+        with s.makefile("r", encoding="utf-8") as f:
+            line = f.readline()
+    if not line: raise ConnectionError("control socket closed without a response")
+    return json.loads(line)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            raw = raw.strip()
+            if not raw: continue
+            try: cmd = json.loads(raw)
+            except ValueError: resp = {"ok": False, "error": "invalid json"}
+            else:
+                try: resp = self.server.dispatch(cmd) if isinstance(cmd, dict) \
+                    else {"ok": False, "error": "expected an object"}
+                except Exception as e: resp = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(resp, ensure_ascii=False) + "\n").encode())
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, dispatch):
+        self.path = str(path)
+        self.dispatch = dispatch            # dict request -> dict response
+        try: os.unlink(self.path)           # left over from a previous run
+        except FileNotFoundError: pass
+        super().__init__(self.path, _Handler)
+        os.chmod(self.path, 0o600)          # it can block traffic: owner only
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        try: os.unlink(self.path)
+        except FileNotFoundError: pass
+
+def _inotify(directory: str):
+    """Non-blocking inotify fd watching directory for writes and new files, or None."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0: return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory),
+                                  IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+class CommandTail:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.offset = 0
+        self.ino = None
+        self.partial = b""
+
+    def read_new(self) -> list:
+        """Complete lines appended since the last call."""
+        try: f = self.path.open("rb")
+        except FileNotFoundError: return []
+        with f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self.ino or st.st_size < self.offset:
+                self.ino, self.offset, self.partial = st.st_ino, 0, b""
+            if st.st_size == self.offset: return []
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        *lines, self.partial = (self.partial + data).split(b"\n")
+        return [l.decode("utf-8", "replace") for l in lines if l.strip()]
+
+    def follow(self, on_line, poll: float = 1.0):
+        """Calls on_line for every new line, forever."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = _inotify(str(self.path.parent))
+        while True:
+            for line in self.read_new(): on_line(line)
+            if fd is None:
+                select.select([], [], [], poll)
+                continue
+            # the timeout also covers events inotify misses (e.g. NFS)
+            while select.select([fd], [], [], poll)[0]:
+                # detections are written to the same directory: wake up for our file only
+                if self.path.name in _event_names(fd): break
+
+def _event_names(fd: int) -> set:
+    names = set()
+    try: data = os.read(fd, 65536)
+    except BlockingIOError: return names
+    off = 0
+    while off + 16 <= len(data):
+        _wd, _mask, _cookie, n = _EVENT.unpack_from(data, off)
+        names.add(os.fsdecode(data[off + 16:off + 16 + n].rstrip(b"\0")))
+        off += 16 + n
+    return names
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Per-key sliding-window counters with constant cost per event.
+
+Each key owns a small ring of time buckets (window / buckets seconds wide)
+plus a running total. A hit clears the buckets that fell out of the window
+since the key was last touched and bumps the current one, so the cost does
+not depend on the packet rate and memory is one short list per key.
+The count covers the last `window` seconds plus at most one bucket width,
+i.e. it errs on the side of blocking.
+"""
+import hashlib, math
+from state import BoundedTable
+
+class WindowCounters:
+    def __init__(self, window: float, buckets: int = 16, table: BoundedTable | None = None):
+        self.window = window
+        self.width = window / buckets
+        self.slots = buckets + 1          # one extra slot for the partial current bucket
+        # key -> [newest bucket epoch, total, ring]; a bounded table evicts idle keys
+        self.table = table if table is not None else BoundedTable()
+
+    def _advance(self, rec, epoch: int):
+        last = rec[0]
+        if epoch <= last: return
+        ring = rec[2]
+        if epoch - last >= self.slots:
+            ring[:] = [0] * self.slots
+            rec[1] = 0
+        else:
+            for e in range(last + 1, epoch + 1):
+                i = e % self.slots
+                rec[1] -= ring[i]
+                ring[i] = 0
+        rec[0] = epoch
+
+    def hit(self, key, now: float, n: int = 1) -> int:
+        """Add n events for key at time now; returns the count in the window."""
+        epoch = int(now // self.width)
+        rec = self.table.get(key)
+        if rec is None:
+            rec = [epoch, 0, [0] * self.slots]
+        else:
+            self._advance(rec, epoch)
+        rec[2][epoch % self.slots] += n
+        rec[1] += n
+        self.table.touch(key, rec, now)
+        return rec[1]
+
+    def count(self, key, now: float) -> int:
+        rec = self.table.get(key)
+        if rec is None: return 0
+        self._advance(rec, int(now // self.width))
+        return rec[1]
+
+    def __len__(self):
+        return len(self.table)
+
+
+def _hash64(key) -> int:
+    # stable across processes (unlike hash()), so sketches from several processes can be merged
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+
+class DistinctWindow:
+    """Distinct keys seen in the last `window` seconds.
+
+    Exact while the window holds at most `cap` keys: key -> newest bucket epoch,
+    plus per-bucket sets of the keys whose newest sighting is that bucket.
+    Every add also updates a HyperLogLog sketch per bucket, and a running
+    register-wise max over the window with its harmonic sum, so switching to
+    the estimate is free. Past the cap the exact tables are dropped; exact
+    tracking restarts once the estimate falls under cap/2 and takes over again
+    after one full window. Memory is bounded by cap keys plus
+    (buckets+1) * 2**p bytes of registers.
+    """
+    def __init__(self, window: float, cap: int = 10000, buckets: int = 8, p: int = 10):
+        self.window = window
+        self.cap = cap
+        self.width = window / buckets
+        self.slots = buckets + 1
+        self.p = p
+        self.m = 1 << p
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)
+        self.regs = [bytearray(self.m) for _ in range(self.slots)]
+        self.wmax = bytearray(self.m)          # max over the window's buckets
+        self.hsum = float(self.m)              # sum of 2**-wmax[j]
+        self.zeros = self.m
+        self.epoch = None
+        self.latest = {}                       # key -> newest epoch (exact mode)
+        self.by_slot = [set() for _ in range(self.slots)]
+        self.exact = True
+        self.exact_since = None                # epoch exact tracking restarted at
+
+    def _advance(self, epoch: int):
+        if self.epoch is None:
+            self.epoch = epoch
+            return
+        if epoch <= self.epoch: return
+        for e in range(self.epoch + 1, min(epoch, self.epoch + self.slots) + 1):
+            i = e % self.slots
+            self.regs[i] = bytearray(self.m)
+            for k in self.by_slot[i]:
+                if self.latest.get(k) == e - self.slots:
+                    del self.latest[k]
+            self.by_slot[i] = set()
+        self.epoch = epoch
+        self._rebuild()
+        if not self.exact:
+            if self.exact_since is None and self.estimate() < self.cap / 2:
+                self.latest.clear()
+                self.exact_since = epoch
+            elif self.exact_since is not None and epoch - self.exact_since >= self.slots:
+                self.exact = True
+                self.exact_since = None
+
+    def _rebuild(self):
+        wmax = bytearray(self.m)
+        for regs in self.regs:
+            wmax = bytearray(map(max, wmax, regs))
+        self.wmax = wmax
+        self.hsum = sum(2.0 ** -r for r in wmax)
+        self.zeros = wmax.count(0)
+
+    def add(self, key, now: float):
+        epoch = int(now // self.width)
+        self._advance(epoch)
+        slot = epoch % self.slots
+        h = _hash64(key)
+        j = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        r = 64 - self.p - rest.bit_length() + 1
+        regs = self.regs[slot]
+        if r > regs[j]:
+            regs[j] = r
+            old = self.wmax[j]
+            if r > old:
+                self.hsum += 2.0 ** -r - 2.0 ** -old
+                if old == 0: self.zeros -= 1
+                self.wmax[j] = r
+        if self.exact or self.exact_since is not None:
+            prev = self.latest.get(key)
+            if prev != epoch:
+                if prev is not None: self.by_slot[prev % self.slots].discard(key)
+                self.latest[key] = epoch
+                self.by_slot[slot].add(key)
+                if len(self.latest) > self.cap:
+                    self.exact = False
+                    self.exact_since = None
+                    self.latest.clear()
+                    self.by_slot = [set() for _ in range(self.slots)]
+
+    def estimate(self) -> int:
+        e = self.alpha * self.m * self.m / self.hsum
+        if e <= 2.5 * self.m and self.zeros:
+            e = self.m * math.log(self.m / self.zeros)
+        return int(round(e))
+
+    def count(self, now: float) -> int:
+        self._advance(int(now // self.width))
+        return len(self.latest) if self.exact else self.estimate()
@@ -1,53 +1,93 @@
 #!/usr/bin/env python3
-import argparse, json, os, time, threading
+import argparse, json, os, signal, sys, time, threading
+import multiprocessing as mp
+from collections import Counter
 from datetime import datetime
 from pathlib import Path
-from scapy.all import sniff, IP
-import rules, blocker
+import rules, blocker, counters, state, packets, capture, pcap, eventlog, enforce, control
+try:
+    from scapy.all import sniff
+except ImportError:         # only needed for --capture scapy
+    sniff = None
 
-# per-IP burst history for individual autoblock
-arrival_history = {}
-# last seen timestamp per src for unique-IP-in-window DDOS detection
-last_seen_ts = {}
+# per-IP bucketed arrival counters for individual autoblock (window and caps set in main)
+arrivals = counters.WindowCounters(30, table=state.BoundedTable("arrivals", 100000, 30))
+# distinct sources in the DDOS window: exact up to a cap, then HyperLogLog (set in main)
+sources = counters.DistinctWindow(5)
+state.probes["sources"] = lambda: {"size": len(sources.latest), "cap": sources.cap,
+                                   "exact": sources.exact}
+state.probes["blocker"] = blocker.stats
 
-commands_seen = set()
+# sharded mode: per-shard distinct-source counts in shared memory (see run_shard)
+shard_counts = None
+shard_index = 0
+
+# time source for all windows and events; --replay swaps in the packet timestamps
+clock = time.time
+echo = True                 # print events to stdout
+events = None               # eventlog.EventWriter, started per process in main
+emitted = Counter()         # reason -> events written
+stages = None               # StageTimer while replaying
+
+class StageTimer:
+    """Wall time spent in each stage of handle_packet (enabled for --replay only)."""
+    def __init__(self):
+        self.ns = Counter(); self.calls = Counter(); self.t = 0
+
+    def start(self):
+        self.t = time.perf_counter_ns()
+
+    def lap(self, stage: str):
+        t = time.perf_counter_ns()
+        self.ns[stage] += t - self.t; self.calls[stage] += 1
+        self.t = t
 
 def record_arrival(src: str):
-    t = time.time()
-    arrival_history.setdefault(src, []).append(t)
-    last_seen_ts[src] = t
+    t = clock()
+    arrivals.hit(src, t)
+    sources.add(src, t)
 
 def count_recent(src: str, window: int) -> int:
-    t = time.time()
-    xs = [x for x in arrival_history.get(src, []) if t - x <= window]
-    arrival_history[src] = xs
-    return len(xs)
+    global arrivals
+    if arrivals.window != window:
+        arrivals = counters.WindowCounters(window, table=state.BoundedTable(
+            "arrivals", arrivals.table.cap, window * 1.1))
+    return arrivals.count(src, clock())
 
 def unique_sources_in_window(window_sec: float) -> int:
-    t = time.time()
-    return sum(1 for ts in last_seen_ts.values() if t - ts <= window_sec)
+    global sources
+    if sources.window != window_sec:
+        sources = counters.DistinctWindow(window_sec, sources.cap)
+    n = sources.count(clock())
+    if shard_counts is None: return n
+    # shards own disjoint sets of sources, so the global distinct count is the sum
+    shard_counts[shard_index] = n
+    return sum(shard_counts)
 
 def emit_event(pkt, reason: str, path: str, extra: dict | None = None):
-    ip = pkt[IP]
     ev = {
-        "time": datetime.utcnow().isoformat() + "Z",
-        "src": ip.src,
-        "dst": ip.dst,
-        "proto": ip.proto,
-        "length": len(pkt),
+        "time": datetime.utcfromtimestamp(clock()).isoformat() + "Z",
+        "src": pkt.src,
+        "dst": pkt.dst,
+        "proto": pkt.proto,
+        "length": pkt.length,
         "reason": reason
     }
     if extra: ev.update(extra)
-    print(json.dumps(ev), flush=True)
-    if path:
-        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(ev, ensure_ascii=False) + "\n")
+    _write(ev, path)
 
 def emit_meta(reason: str, path: str, extra: dict | None = None):
-    ev = {"time": datetime.utcnow().isoformat() + "Z", "reason": reason}
+    ev = {"time": datetime.utcfromtimestamp(clock()).isoformat() + "Z", "reason": reason}
     if extra: ev.update(extra)
-    print(json.dumps(ev), flush=True)
+    _write(ev, path)
+
+def _write(ev: dict, path: str):
+    emitted[ev["reason"]] += 1
+    # the writer thread owns the file (opened on --jsonl); never touch disk here
+    if events is not None:
+        events.put(ev)
+        return
+    if echo: print(json.dumps(ev), flush=True)
     if path:
         os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
         with open(path, "a", encoding="utf-8") as f:
@@ -55,15 +95,18 @@ def emit_meta(reason: str, path: str, extra: dict | None = None):
 
 def handle_packet(pkt, jsonl_path, auto_block, ab_threshold, ab_window, ab_duration,
                   ddos_unique_threshold, ddos_window_sec, ddos_duration):
-    if IP not in pkt: return
-    src = pkt[IP].src
+    """pkt is a packets.PacketInfo (None for non-IPv4 frames)."""
+    if pkt is None: return
+    src = pkt.src
+    st = stages
+    if st: st.start()
     
-    if blocker.is_global_locked() and not blocker.is_whitelisted(src):
-        print("LOCKDOWN BLOCK")
-        return
+    # dropped silently: the start of the lockdown is logged once, as ddos_lockdown
+    if blocker.is_global_locked() and not blocker.is_whitelisted(src): return
 
     # global lock check (whitelist bypass happens inside blocker.is_blocked)
     if blocker.is_blocked(src): return
+    if st: st.lap("blocker")
 
     # rules
     trig1, reason1 = rules.rule_high_packet_rate(pkt, rules.state)
@@ -71,16 +114,19 @@ def handle_packet(pkt, jsonl_path, auto_block, ab_threshold, ab_window, ab_durat
     triggered = []
     if trig1: triggered.append(reason1)
     if trig2: triggered.append(reason2)
+    if st: st.lap("rules")
 
     # record and maybe emit
     if triggered:
         emit_event(pkt, "+".join(triggered), jsonl_path)
+    if st: st.lap("emit")
     record_arrival(src)
 
     # individual autoblock
     if auto_block and count_recent(src, ab_window) >= ab_threshold:
         try: blocker.block_ip(src, ab_duration)
         except Exception: pass
+    if st: st.lap("counters")
 
     # DDOS detection: too many unique sources within short window
     if unique_sources_in_window(ddos_window_sec) >= ddos_unique_threshold:
@@ -91,37 +137,200 @@ def handle_packet(pkt, jsonl_path, auto_block, ab_threshold, ab_window, ab_durat
             "window_sec": ddos_window_sec,
             "lockdown_sec": ddos_duration
         })
+    if st: st.lap("ddos")
+
+def apply_command(cmd: dict) -> dict:
+    """One control request (socket or commands.jsonl line) -> response."""
+    c = cmd.get("cmd"); ip = cmd.get("ip")
+    if c == "stats": return {"ok": True, "stats": state.stats()}
+    if c == "blocks": return {"ok": True, "blocks": blocker.active_blocks()}
+    if c not in ("block", "unblock", "whitelist", "unwhitelist"):
+        return {"ok": False, "error": f"unknown command {c!r}"}
+    if not ip: return {"ok": False, "error": "missing ip"}
+    if c == "block": ok = blocker.block_ip(ip, cmd.get("duration", 0))
+    elif c == "unblock": ok = blocker.unblock_ip(ip)
+    elif c == "whitelist": ok = blocker.add_whitelist(ip)
+    else: ok = blocker.remove_whitelist(ip)
+    return {"ok": True} if ok else {"ok": False, "error": f"{c} {ip} rejected"}
+
+def tail_commands(cmd_path: str):
+    def on_line(raw):
+        try: cmd = json.loads(raw)
+        except ValueError: return
+        if isinstance(cmd, dict): apply_command(cmd)
+    while True:
+        try: control.CommandTail(cmd_path).follow(on_line)
+        except Exception: time.sleep(1)
+
+def serve_pipe(conn):
+    """Shard side of the control relay: requests from the parent, one reply each."""
+    while True:
+        try: req = conn.recv()
+        except EOFError: return
+        try: conn.send(apply_command(req))
+        except Exception as e: conn.send({"ok": False, "error": str(e)})
+
+def report_stats(jsonl_path: str, interval: float):
+    while True:
+        time.sleep(interval)
+        emit_meta("state_stats", jsonl_path, {"tables": state.stats()})
 
-def poll_commands(cmd_path: str, whitelist_path: str):
-    p = Path(cmd_path)
+def setup_state(a):
+    global arrivals, sources
+    # a source idle for a whole window has a zero count, so evicting it loses nothing
+    arrivals = counters.WindowCounters(a.block_window, table=state.BoundedTable(
+        "arrivals", a.arrivals_cap, a.block_window * 1.1))
+    sources = counters.DistinctWindow(a.ddos_window_sec, a.ddos_exact_cap)
+    rules.state["counts"].cap = a.rate_counts_cap
+    rules.state["counts"].ttl = a.rate_counts_ttl
+
+def open_events(a, block: bool = False):
+    global events
+    events = eventlog.EventWriter(a.jsonl, echo, a.event_queue, a.event_batch,
+                                  a.event_interval, eventlog.parse_fsync(a.fsync), block)
+    state.probes["events"] = events.stats
+
+def run_enforcer(interval: float):
+    while True:
+        time.sleep(interval)
+        blocker.enforcer.flush()
+
+def start_threads(a, commands_file):
+    threading.Thread(target=tail_commands, args=(str(commands_file),), daemon=True).start()
+    if blocker.enforcer:
+        state.probes["enforce"] = blocker.enforcer.stats
+        threading.Thread(target=run_enforcer, args=(a.enforce_interval,), daemon=True).start()
+    if a.stats_interval > 0:
+        threading.Thread(target=report_stats, args=(a.jsonl, a.stats_interval), daemon=True).start()
+
+def make_handler(a):
+    return lambda pkt: handle_packet(
+        pkt, a.jsonl,
+        a.auto_block, a.block_threshold, a.block_window, a.block_duration,
+        a.ddos_unique_threshold, a.ddos_window_sec, a.ddos_duration
+    )
+
+def run_capture(cap, handle, on_batch=None):
+    state.probes["capture"] = cap.stats
+    try:
+        for batch in cap.batches():
+            for pkt in batch: handle(pkt)
+            if on_batch: on_batch()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.close()
+
+def run_replay(a, handle):
+    """Feeds a pcap through the full pipeline as fast as possible. Every window,
+    block expiry and event time follows the packet timestamps, so a replay of
+    the same file with the same options always gives the same detections."""
+    global clock, echo, stages
+    now = [0.0]
+    clock = lambda: now[0]
+    blocker._now = clock
+    for t in state.tables.values(): t.clock = clock
+    echo = a.echo
+    open_events(a, block=True)      # offline: wait for the writer rather than drop
+    stages = StageTimer()
+    parse_ns = n = 0
+    enf = blocker.enforcer
+    next_flush = 0.0
+    reader = pcap.read_pcap(a.replay)
+    t0 = time.perf_counter()
     while True:
+        p0 = time.perf_counter_ns()
+        pkt = next(reader, False)
+        parse_ns += time.perf_counter_ns() - p0
+        if pkt is False: break
+        n += 1
+        if pkt is not None: now[0] = pkt.ts
+        handle(pkt)
+        # enforcement ticks follow packet time as well
+        if enf and now[0] >= next_flush:
+            enf.flush()
+            next_flush = now[0] + a.enforce_interval
+    if enf: enf.flush()
+    elapsed = time.perf_counter() - t0
+
+    stages.ns["parse"] = parse_ns; stages.calls["parse"] = n
+    total_ns = sum(stages.ns.values()) or 1
+    found = dict(emitted)
+    emit_meta("replay_summary", a.jsonl, {
+        "file": a.replay, "packets": n, "seconds": round(elapsed, 3),
+        "pkt_per_sec": round(n / elapsed) if elapsed else 0,
+        "stage_us": {s: round(stages.ns[s] / stages.calls[s] / 1e3, 3)
+                     for s in stages.ns if stages.calls[s]},
+        "detections": found})
+    events.close()
+    print(f"{n} packets in {elapsed:.3f}s: {n / elapsed if elapsed else 0:.0f} pkt/s")
+    print(f"{'stage':10} {'calls':>9} {'avg us':>8} {'share':>6}")
+    for s in ("parse", "blocker", "rules", "emit", "counters", "ddos"):
+        calls = stages.calls[s]
+        print(f"{s:10} {calls:>9} {stages.ns[s] / calls / 1e3 if calls else 0:>8.2f} "
+              f"{stages.ns[s] / total_ns:>6.1%}")
+    print("detections:")
+    for reason, c in sorted(found.items()):
+        print(f"  {reason:24} {c}")
+
+def run_shard(a, idx, counts, lock_until, group, commands_file, conn):
+    global shard_counts, shard_index
+    shard_counts, shard_index = counts, idx
+    blocker.share_lockdown(lock_until)
+    state.probes["shard"] = lambda: {"index": idx, "of": a.shards}
+    open_events(a)
+    start_threads(a, commands_file)
+    threading.Thread(target=serve_pipe, args=(conn,), daemon=True).start()
+    cap = capture.RingCapture(a.iface, a.bpf, fanout_group=group)
+    # publish this shard's count even while it gets no packets, so the sum decays
+    try:
+        run_capture(cap, make_handler(a),
+                    lambda: counts.__setitem__(idx, sources.count(time.time())))
+    finally:
+        events.close()
+
+def relay(conns, lock, req: dict) -> dict:
+    """Parent side: every shard applies the request; ok only if all of them did."""
+    with lock:
         try:
-            if p.exists():
-                with p.open("r", encoding="utf-8") as fh:
-                    for line in fh:
-                        raw = line.strip()
-                        if not raw or raw in commands_seen: continue
-                        commands_seen.add(raw)
-                        try: cmd = json.loads(raw)
-                        except Exception: continue
-                        c = cmd.get("cmd"); ip = cmd.get("ip")
-                        if c == "block" and ip:
-                            try: blocker.block_ip(ip, cmd.get("duration", 0))
-                            except Exception: pass
-                        elif c == "whitelist" and ip:
-                            try: blocker.add_whitelist(ip)
-                            except Exception: pass
-                        elif c == "unwhitelist" and ip:
-                            try: blocker.remove_whitelist(ip)
-                            except Exception: pass
-        except Exception:
-            pass
-        time.sleep(1)
+            for c in conns: c.send(req)
+            replies = [c.recv() for c in conns]
+        except (EOFError, OSError) as e:
+            return {"ok": False, "error": f"shard unavailable: {e}"}
+    return {"ok": all(r.get("ok") for r in replies), "shards": replies}
+
+def run_sharded(a, commands_file):
+    # shards inherit the whitelist, the enforcer (and its lock) and the state caps
+    # from this process, so they must be forked whatever the platform default is
+    ctx = mp.get_context("fork")
+    counts = ctx.Array("q", a.shards, lock=False)
+    lock_until = ctx.Value("d", 0.0)
+    group = os.getpid() & 0xffff
+    pipes = [ctx.Pipe() for _ in range(a.shards)]
+    procs = [ctx.Process(target=run_shard, args=(a, i, counts, lock_until, group,
+                                                commands_file, pipes[i][1]), daemon=True)
+             for i in range(a.shards)]
+    for p in procs: p.start()
+    conns, lock = [p[0] for p in pipes], threading.Lock()
+    server = control.ControlServer(a.control, lambda req: relay(conns, lock, req))
+    try:
+        for p in procs: p.join()
+    except KeyboardInterrupt:
+        for p in procs: p.terminate()
+    finally:
+        server.close()
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("-i", "--iface", required=True)
+    ap.add_argument("-i", "--iface")
+    ap.add_argument("--replay", metavar="PCAP",
+                    help="run the pipeline over a capture file on its own timestamps, then print throughput")
+    ap.add_argument("--echo", action="store_true", help="with --replay: print events to stdout too")
     ap.add_argument("--bpf", default="ip")
+    ap.add_argument("--capture", choices=["scapy", "afpacket"], default="scapy",
+                    help="afpacket: TPACKET_V3 ring + struct parser, no scapy dissection")
+    ap.add_argument("--shards", type=int, default=1,
+                    help="worker processes, sources split by kernel fanout (needs --capture afpacket)")
     ap.add_argument("--jsonl", default="logs/detections.jsonl")
 
     # per-IP autoblock
@@ -137,29 +346,88 @@ def main():
                     help="window in seconds for unique source counting")
     ap.add_argument("--ddos-duration", type=int, default=10,
                     help="global lockdown duration (seconds)")
+    ap.add_argument("--ddos-exact-cap", type=int, default=10000,
+                    help="count sources exactly up to this many, then switch to HyperLogLog")
+
+    # memory bounds for per-source state
+    ap.add_argument("--arrivals-cap", type=int, default=100000,
+                    help="max sources tracked for autoblock (least recently seen evicted)")
+    ap.add_argument("--rate-counts-cap", type=int, default=100000,
+                    help="max sources tracked by the high_rate rule")
+    ap.add_argument("--rate-counts-ttl", type=float, default=300,
+                    help="forget high_rate counters idle for this many seconds")
+    ap.add_argument("--stats-interval", type=float, default=60,
+                    help="emit a state_stats event every N seconds (0 = never)")
+
+    # control channel
+    ap.add_argument("--control", metavar="SOCKET",
+                    help="Unix socket for block/unblock/whitelist/stats requests (default: <jsonl dir>/detector.sock)")
+
+    # kernel enforcement of blocks, whitelist and lockdown
+    ap.add_argument("--enforce", choices=["none", "nft", "ipset", "record"], default="none",
+                    help="mirror blocker state into nftables sets, ipset, or just record the updates")
+    ap.add_argument("--enforce-interval", type=float, default=0.5,
+                    help="seconds between batched set updates")
+    ap.add_argument("--enforce-table", default="ids",
+                    help="nft table / ipset name prefix (record: logs/enforce.jsonl)")
+
+    # event output (background writer)
+    ap.add_argument("--event-queue", type=int, default=10000,
+                    help="max events waiting for the writer; newer ones are dropped and counted")
+    ap.add_argument("--event-batch", type=int, default=256,
+                    help="commit as soon as this many events are queued")
+    ap.add_argument("--event-interval", type=float, default=0.2,
+                    help="or this many seconds after the first queued event")
+    ap.add_argument("--fsync", default="never", metavar="never|batch|SECONDS",
+                    help="fsync the jsonl never, after every commit, or at most every N seconds")
 
     a = ap.parse_args()
+    if not a.iface and not a.replay:
+        ap.error("one of --iface or --replay is required")
+    if a.shards > 1 and a.capture != "afpacket":
+        ap.error("--shards needs --capture afpacket")
+    try: eventlog.parse_fsync(a.fsync)
+    except ValueError: ap.error("--fsync takes never, batch or a number of seconds")
+    setup_state(a)
 
     logs_dir = Path(a.jsonl).resolve().parent
     whitelist_file = logs_dir / "whitelist.jsonl"
     commands_file = logs_dir / "commands.jsonl"
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    if not a.control: a.control = str(logs_dir / "detector.sock")
     
     with open(whitelist_file, 'w', encoding='utf-8') as _:
         pass
     blocker.load_whitelist(str(whitelist_file))
+    if a.enforce != "none":
+        # set up once here; shard processes inherit the backend
+        try: e = enforce.create(a.enforce, a.enforce_table, str(logs_dir / "enforce.jsonl"))
+        except Exception as ex: ap.error(f"--enforce {a.enforce}: {ex}")
+        blocker.set_enforcer(e)
 
-    threading.Thread(target=poll_commands, args=(str(commands_file), str(whitelist_file)), daemon=True).start()
-
-    sniff(
-        iface=a.iface,
-        filter=a.bpf,
-        prn=lambda pkt: handle_packet(
-            pkt, a.jsonl,
-            a.auto_block, a.block_threshold, a.block_window, a.block_duration,
-            a.ddos_unique_threshold, a.ddos_window_sec, a.ddos_duration
-        ),
-        store=False
-    )
+    if a.replay:
+        return run_replay(a, make_handler(a))
+    # SystemExit unwinds through the finally blocks, so queued events get written
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    if a.shards > 1:
+        return run_sharded(a, commands_file)
+    if a.capture == "scapy" and sniff is None: ap.error("scapy is not installed, use --capture afpacket")
+    open_events(a)
+    start_threads(a, commands_file)
+    server = control.ControlServer(a.control, apply_command)
+    handle = make_handler(a)
+    try:
+        if a.capture == "afpacket":
+            return run_capture(capture.open_capture(a.iface, a.bpf), handle)
+        sniff(
+            iface=a.iface,
+            filter=a.bpf,
+            prn=lambda p: handle(packets.from_scapy(p)),
+            store=False
+        )
+    finally:
+        server.close()
+        events.close()
 
 if __name__ == "__main__":
     main()
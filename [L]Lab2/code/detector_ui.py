@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import json, subprocess, sys, threading, pathlib, os, time
+import json, subprocess, sys, threading, pathlib, os, time, socket
 from typing import Set
 from PyQt5.QtCore import Qt, QProcess
 from PyQt5.QtGui import QFont
@@ -8,6 +8,7 @@ from PyQt5.QtWidgets import (
     QMainWindow, QPushButton, QPlainTextEdit, QSpinBox, QSplitter, QWidget,
     QGridLayout, QFormLayout, QMessageBox, QHBoxLayout
 )
+import control
 
 class DetectorProcessManager:
     def __init__(self, parent, detector_path):
@@ -116,6 +117,7 @@ class MainWindow(QMainWindow):
         self.logs_dir = self.app_dir / "logs"; self.logs_dir.mkdir(exist_ok=True)
         self.jsonl_path = self.logs_dir / "detections.jsonl"
         self.cmds_path = self.logs_dir / "commands.jsonl"
+        self.control_path = self.logs_dir / "detector.sock"
 
         self.proc_mgr = DetectorProcessManager(self, self.detector_path)
 
@@ -198,17 +200,31 @@ class MainWindow(QMainWindow):
             self.observed_list.setItemWidget(item, widget)
             self.item_map[ip] = (item, widget)
 
+    def _send_command(self, cmd) -> str:
+        """Control socket of the running detector first (applied at once, with a reply);
+        commands.jsonl if there is none. Returns how the command went out."""
+        if hasattr(socket, "AF_UNIX") and self.control_path.exists():
+            try:
+                resp = control.send(self.control_path, cmd)
+                if not resp.get("ok"):
+                    raise RuntimeError(resp.get("error", "rejected by detector"))
+                return "sent"
+            except (OSError, ValueError):
+                pass
+        with open(self.cmds_path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(cmd, ensure_ascii=False) + "\n")
+        return "written"
+
     def block_ip_command(self, ip):
         dur = int(self.block_duration_spin.value())
         cmd = {"cmd":"block","ip":ip,"duration":dur,"time":int(time.time())}
         try:
-            with open(self.cmds_path, "a", encoding="utf-8") as fh:
-                fh.write(json.dumps(cmd, ensure_ascii=False) + "\n")
+            how = self._send_command(cmd)
             pair = self.item_map.get(ip)
             if pair:
                 _, widget = pair
                 widget.set_blocked_state(True)
-            self._append_log(f"[ui] block command written for {ip} dur={dur}\n")
+            self._append_log(f"[ui] block command {how} for {ip} dur={dur}\n")
         except Exception as e:
             self._append_log(f"[ui] failed to write command: {e}\n")
 
@@ -216,15 +232,14 @@ class MainWindow(QMainWindow):
         cmd_name = "whitelist" if add_whitelist else "unwhitelist"
         cmd = {"cmd":cmd_name,"ip":ip,"time":int(time.time())}
         try:
-            with open(self.cmds_path, "a", encoding="utf-8") as fh:
-                fh.write(json.dumps(cmd, ensure_ascii=False) + "\n")
+            how = self._send_command(cmd)
             pair = self.item_map.get(ip)
             if pair:
                 _, widget = pair
                 widget.set_whitelisted_state(add_whitelist)
                 if add_whitelist:
                     widget.set_blocked_state(True)
-            self._append_log(f"[ui] {cmd_name} command written for {ip}\n")
+            self._append_log(f"[ui] {cmd_name} command {how} for {ip}\n")
         except Exception as e:
             self._append_log(f"[ui] failed to write whitelist command: {e}\n")
 
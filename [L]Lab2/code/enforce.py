@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""Kernel enforcement of the blocker state.
+
+blocker.py only makes the detector ignore packets; an Enforcer mirrors
+block/unblock, whitelist and lockdown into kernel sets so the traffic is
+dropped before it reaches anything else. Calls from the packet path only
+record the operation; flush() (every --enforce-interval) coalesces them
+per address (the last one wins) and applies the whole tick in one go:
+
+  NftEnforcer     one `nft -f -` transaction, atomic; sets with per-element
+                  timeouts, so expiries need no further updates
+  IpsetEnforcer   one `ipset restore` run (batched, applied in order but not
+                  atomic) plus an iptables chain installed at setup
+  RecordEnforcer  no root needed: keeps the transactions and optionally
+                  appends them to a JSONL file
+
+Entries are IPv4 addresses or CIDR prefixes; the detector does not parse
+IPv6. nft interval sets reject overlapping elements, so NftEnforcer keeps
+one set per prefix length (created on first use): prefixes of equal length
+are either equal or disjoint. Shards created with --shards share the table,
+so a set and its rule are added under a lock shared by all of them, after
+checking which sets the table already has.
+"""
+import json, multiprocessing, re, shutil, subprocess, sys, threading
+from abc import ABC, abstractmethod
+from radix import parse_prefix
+
+LOCKDOWN = "lockdown"       # pending-op key of the single lockdown entry
+
+def _ipv4(ip: str) -> bool:
+    try: parse_prefix(ip)
+    except ValueError: return False
+    return True
+
+class Enforcer(ABC):
+    name = "none"
+
+    def __init__(self):
+        self.pending = {}           # (set, ip) -> op
+        self.lock = threading.Lock()
+        self.transactions = self.ops = self.failures = self.skipped = 0
+
+    # ops: ("block", ip, seconds|None), ("unblock", ip), ("allow", ip),
+    # ("disallow", ip), ("lockdown", None, seconds); seconds 0 ends the lockdown
+    def _queue(self, key, op):
+        with self.lock: self.pending[key] = op
+
+    def block(self, ip: str, seconds: int | None = None):
+        if not _ipv4(ip): self.skipped += 1; return
+        self._queue(("blocked", ip), ("block", ip, seconds))
+
+    def unblock(self, ip: str):
+        if not _ipv4(ip): return
+        self._queue(("blocked", ip), ("unblock", ip))
+
+    def allow(self, ip: str):
+        if not _ipv4(ip): self.skipped += 1; return
+        self._queue(("allow", ip), ("allow", ip))
+
+    def disallow(self, ip: str):
+        if not _ipv4(ip): return
+        self._queue(("allow", ip), ("disallow", ip))
+
+    def lockdown(self, seconds: int):
+        self._queue((LOCKDOWN, None), ("lockdown", None, max(0, int(seconds))))
+
+    def flush(self):
+        with self.lock:
+            if not self.pending: return
+            ops, self.pending = list(self.pending.values()), {}
+        try:
+            self.apply(ops)
+        except Exception as e:
+            self.failures += 1
+            print(f"[enforce] {self.name}: {e}", file=sys.stderr, flush=True)
+            return
+        self.transactions += 1
+        self.ops += len(ops)
+
+    def setup(self): pass
+
+    @abstractmethod
+    def apply(self, ops):
+        """Apply one tick of coalesced ops to the kernel; raise on failure."""
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "pending": len(self.pending), "transactions": self.transactions,
+                "ops": self.ops, "failures": self.failures, "skipped_non_ipv4": self.skipped}
+
+def _run(cmd, script: str):
+    r = subprocess.run(cmd, input=script, capture_output=True, text=True)
+    if r.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)}: {r.stderr.strip()}")
+
+class NftEnforcer(Enforcer):
+    name = "nft"
+
+    def __init__(self, table: str = "ids"):
+        super().__init__()
+        if not shutil.which("nft"): raise RuntimeError("nft not found")
+        self.table = table
+        self.sets = set()           # per-length sets already created, e.g. "blocked4_24"
+        self.new_sets = set()       # created by the transaction being applied
+        # taken before fork, so every shard process gets the same lock
+        self.create_lock = multiprocessing.Lock()
+
+    def setup(self):
+        t = self.table
+        # add+delete+add: recreate the table in one transaction whether it existed or not
+        _run(["nft", "-f", "-"], f"""add table inet {t}
+delete table inet {t}
+table inet {t} {{
+    set lockdown4 {{ type ipv4_addr; flags interval, timeout; }}
+    chain allow {{
+    }}
+    chain deny {{
+    }}
+    chain input {{
+        type filter hook input priority -10; policy accept;
+        # replies to the host's own connections (and live SSH sessions) survive a lockdown
+        ct state established,related accept
+        iif lo accept
+        jump allow
+        ip saddr @lockdown4 drop
+        jump deny
+    }}
+}}
+""")
+        self.sets.clear()
+
+    def _set(self, kind: str, n: int) -> str:
+        """Name of the per-length set; unknown ones are created by script()."""
+        name = f"{kind}4_{n}"
+        if name not in self.sets: self.new_sets.add(name)
+        return name
+
+    def _define(self, name: str) -> list[str]:
+        t = self.table
+        if name.startswith("allow"):
+            return [f"add set inet {t} {name} {{ type ipv4_addr; flags interval; }}",
+                    f"add rule inet {t} allow ip saddr @{name} accept"]
+        return [f"add set inet {t} {name} {{ type ipv4_addr; flags interval, timeout; }}",
+                f"add rule inet {t} deny ip saddr @{name} drop"]
+
+    def _listed_sets(self) -> set[str]:
+        """Sets the kernel table has now, including ones other shards created."""
+        r = subprocess.run(["nft", "list", "table", "inet", self.table], capture_output=True, text=True)
+        if r.returncode != 0:
+            raise RuntimeError(f"nft list table: {r.stderr.strip()}")
+        return set(re.findall(r"^\s*set (\w+) \{", r.stdout, re.M))
+
+    def script(self, ops) -> str:
+        t = self.table
+        lines = []
+        def replace(set_name, elem, timeout):
+            # add first so the delete cannot fail on a missing (or expired) element
+            lines.append(f"add element inet {t} {set_name} {{ {elem} }}")
+            lines.append(f"delete element inet {t} {set_name} {{ {elem} }}")
+            if timeout is not False:
+                suffix = f" timeout {timeout}s" if timeout else ""
+                lines.append(f"add element inet {t} {set_name} {{ {elem}{suffix} }}")
+        for op in ops:
+            kind, ip = op[0], op[1]
+            if kind == "lockdown":
+                replace("lockdown4", "0.0.0.0/0", op[2] or False)
+                continue
+            n = parse_prefix(ip)[1]
+            if kind == "block": replace(self._set("blocked", n), ip, op[2] or None)
+            elif kind == "unblock": replace(self._set("blocked", n), ip, False)
+            elif kind == "allow": lines.append(f"add element inet {t} {self._set('allow', n)} {{ {ip} }}")
+            elif kind == "disallow": replace(self._set("allow", n), ip, False)
+        # sets and their rules go first, in the same transaction as their elements
+        lines[:0] = [line for name in sorted(self.new_sets) for line in self._define(name)]
+        return "\n".join(lines) + "\n"
+
+    def apply(self, ops):
+        self.new_sets.clear()
+        try:
+            script = self.script(ops)
+            if not self.new_sets:
+                _run(["nft", "-f", "-"], script)
+                return
+            # `add rule` is not idempotent: check and create under the shared lock,
+            # or two shards would each append a drop rule for the same set
+            with self.create_lock:
+                self.sets |= self._listed_sets()
+                self.new_sets.clear()
+                _run(["nft", "-f", "-"], self.script(ops))
+                self.sets |= self.new_sets
+        finally:
+            self.new_sets.clear()
+
+class IpsetEnforcer(Enforcer):
+    name = "ipset"
+
+    def __init__(self, prefix: str = "ids"):
+        super().__init__()
+        for tool in ("ipset", "iptables"):
+            if not shutil.which(tool): raise RuntimeError(f"{tool} not found")
+        self.prefix = prefix
+
+    def setup(self):
+        p = self.prefix
+        # hash:net holds host addresses and prefixes of any length side by side
+        _run(["ipset", "restore"], f"""create {p}-allow hash:net -exist
+create {p}-blocked hash:net timeout 0 -exist
+create {p}-lockdown hash:net timeout 0 -exist
+flush {p}-allow
+flush {p}-blocked
+flush {p}-lockdown
+""")
+        chain = p.upper()
+        subprocess.run(["iptables", "-N", chain], capture_output=True)
+        subprocess.run(["iptables", "-F", chain], check=True)
+        for rule in (["-m", "conntrack", "--ctstate", "ESTABLISHED,RELATED", "-j", "RETURN"],
+                     ["-i", "lo", "-j", "RETURN"],
+                     ["-m", "set", "--match-set", f"{p}-allow", "src", "-j", "RETURN"],
+                     ["-m", "set", "--match-set", f"{p}-lockdown", "src", "-j", "DROP"],
+                     ["-m", "set", "--match-set", f"{p}-blocked", "src", "-j", "DROP"]):
+            subprocess.run(["iptables", "-A", chain] + rule, check=True)
+        if subprocess.run(["iptables", "-C", "INPUT", "-j", chain], capture_output=True).returncode:
+            subprocess.run(["iptables", "-I", "INPUT", "-j", chain], check=True)
+
+    def script(self, ops) -> str:
+        p = self.prefix
+        lines = []
+        for op in ops:
+            kind, ip = op[0], op[1]
+            # hash:net has no /0, two halves cover everything
+            nets = ("0.0.0.0/1", "128.0.0.0/1") if kind == "lockdown" or ip.endswith("/0") else (ip,)
+            for net in nets:
+                if kind == "block": lines.append(f"add {p}-blocked {net} timeout {op[2] or 0} -exist")
+                elif kind == "unblock": lines.append(f"del {p}-blocked {net} -exist")
+                elif kind == "allow": lines.append(f"add {p}-allow {net} -exist")
+                elif kind == "disallow": lines.append(f"del {p}-allow {net} -exist")
+                elif kind == "lockdown":
+                    lines.append(f"add {p}-lockdown {net} timeout {op[2]} -exist" if op[2]
+                                 else f"del {p}-lockdown {net} -exist")
+        return "\n".join(lines) + "\n"
+
+    def apply(self, ops):
+        _run(["ipset", "restore"], self.script(ops))
+
+class RecordEnforcer(Enforcer):
+    name = "record"
+
+    def __init__(self, path: str | None = None):
+        super().__init__()
+        self.path = path
+        self.log = []               # one list of ops per transaction
+
+    def setup(self):
+        if self.path: open(self.path, "w").close()
+
+    def apply(self, ops):
+        self.log.append(ops)
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"ops": ops}) + "\n")
+
+def create(kind: str, table: str = "ids", record_path: str | None = None) -> Enforcer:
+    if kind == "nft": e = NftEnforcer(table)
+    elif kind == "ipset": e = IpsetEnforcer(table)
+    elif kind == "record": e = RecordEnforcer(record_path)
+    else: raise ValueError(f"unknown enforcement backend {kind}")
+    e.setup()
+    return e
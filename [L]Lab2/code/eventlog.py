@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Background writer for detector events.
+
+The capture path only appends the event dict to a bounded queue. A writer
+thread serializes them and commits a group to the JSONL file (kept open in
+append mode) and to stdout with one write and one flush, as soon as `batch`
+events are queued or `interval` seconds after the first one, whichever
+comes first. When the queue is full the event is dropped and counted
+instead of stalling the capture; replay uses block=True to keep every event.
+
+fsync policy: None = never (the page cache decides), 0 = after every group
+commit, N > 0 = at most once per N seconds.
+"""
+import json, os, queue, sys, threading, time
+
+_STOP = object()
+
+def parse_fsync(value: str):
+    if value == "never": return None
+    if value == "batch": return 0.0
+    return float(value)
+
+class EventWriter:
+    def __init__(self, path: str | None, echo: bool = True, max_queue: int = 10000,
+                 batch: int = 256, interval: float = 0.2, fsync: float | None = None,
+                 block: bool = False):
+        self.path = path
+        self.echo = echo
+        self.batch = batch
+        self.interval = interval
+        self.fsync = fsync
+        self.block = block
+        self.q = queue.Queue(max_queue)
+        self.written = self.dropped = self.commits = self.syncs = 0
+        self.f = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.f = open(path, "a", encoding="utf-8")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, ev: dict):
+        if self.block:
+            self.q.put(ev)
+            return
+        try: self.q.put_nowait(ev)
+        except queue.Full: self.dropped += 1
+
+    def _run(self):
+        last_sync = time.monotonic()
+        stop = False
+        while not stop:
+            items = []
+            ev = self.q.get()
+            deadline = time.monotonic() + self.interval
+            while True:
+                if ev is _STOP:
+                    stop = True; break
+                items.append(ev)
+                if len(items) >= self.batch: break
+                left = deadline - time.monotonic()
+                try: ev = self.q.get(timeout=left) if left > 0 else self.q.get_nowait()
+                except queue.Empty: break
+            if not items: continue
+            self._commit(items)
+            if self.f and self.fsync is not None and time.monotonic() - last_sync >= self.fsync:
+                os.fsync(self.f.fileno())
+                self.syncs += 1
+                last_sync = time.monotonic()
+
+    def _commit(self, items):
+        if self.f:
+            self.f.write("".join(json.dumps(ev, ensure_ascii=False) + "\n" for ev in items))
+            self.f.flush()
+        if self.echo:
+            sys.stdout.write("".join(json.dumps(ev) + "\n" for ev in items))
+            sys.stdout.flush()
+        self.written += len(items)
+        self.commits += 1
+
+    def close(self):
+        """Flushes everything queued so far and stops the thread."""
+        if not self.thread.is_alive(): return
+        self.q.put(_STOP)
+        self.thread.join()
+        if self.f:
+            if self.fsync is not None: os.fsync(self.f.fileno())
+            self.f.close()
+
+    def stats(self) -> dict:
+        return {"queued": self.q.qsize(), "written": self.written, "dropped": self.dropped,
+                "commits": self.commits, "fsyncs": self.syncs}
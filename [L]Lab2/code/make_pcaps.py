@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Synthetic captures for `detector.py --replay`, deterministic for a given --seed.
+
+  baseline  - 10 LAN hosts talking to a server on common ports for two minutes
+  portscan  - baseline plus one host sweeping TCP ports 1-1024
+  flood     - baseline plus one host bursting UDP to port 60000 (autoblock)
+  ddos      - baseline plus thousands of spoofed sources, one packet each (lockdown)
+
+Frames carry Ethernet/IPv4/L4 headers only; the wire length is kept in the
+record header, so the files stay small. Regenerate with:
+  python3 make_pcaps.py --out pcaps
+"""
+import argparse, os, random, socket, struct
+from pcap import PcapWriter
+
+SERVER = "192.168.1.1"
+HOSTS = [f"192.168.1.{10 + i}" for i in range(10)]
+START = 1700000000.0
+ETH = b"\x02\x00\x00\x00\x00\x01" + b"\x02\x00\x00\x00\x00\x02" + b"\x08\x00"
+
+def _csum(hdr: bytes) -> int:
+    t = sum(struct.unpack(f"!{len(hdr) // 2}H", hdr))
+    t = (t >> 16) + (t & 0xffff)
+    return ~(t + (t >> 16)) & 0xffff
+
+def frame(src: str, dst: str, proto: int, sport: int, dport: int, length: int) -> bytes:
+    l4 = struct.pack("!HHIIBBHHH", sport, dport, 0, 0, 0x50, 0x02, 65535, 0, 0) if proto == 6 \
+        else struct.pack("!HHHH", sport, dport, length - 34, 0)
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, length - 14, 0, 0, 64, proto, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    ip = ip[:10] + struct.pack("!H", _csum(ip)) + ip[12:]
+    return ETH + ip + l4
+
+def baseline(rng, n: int, duration: float):
+    services = [(6, 443), (6, 443), (6, 80), (17, 53), (17, 123), (6, 22)]
+    for _ in range(n):
+        proto, port = rng.choice(services)
+        yield (START + rng.uniform(0, duration), rng.choice(HOSTS), SERVER, proto,
+               rng.randint(1024, 65535), port, rng.randint(60, 1500))
+
+def portscan(rng):
+    for port in range(1, 1025):
+        yield START + 30 + port * 0.01, "10.0.0.66", SERVER, 6, 40000, port, 60
+
+def flood(rng):
+    for i in range(3000):
+        yield START + 40 + i / 600, "10.0.0.77", SERVER, 17, 50000, 60000, 742
+
+def ddos(rng):
+    for i in range(5000):
+        src = f"172.16.{i // 250}.{i % 250 + 1}"
+        yield START + 60 + rng.uniform(0, 2), src, SERVER, 17, rng.randint(1024, 65535), 12345, 43
+
+SCENARIOS = {
+    "baseline": lambda rng: list(baseline(rng, 6000, 120)),
+    "portscan": lambda rng: list(baseline(rng, 2000, 60)) + list(portscan(rng)),
+    "flood": lambda rng: list(baseline(rng, 2000, 60)) + list(flood(rng)),
+    "ddos": lambda rng: list(baseline(rng, 2000, 120)) + list(ddos(rng)),
+}
+
+def write(path: str, records):
+    with PcapWriter(path) as w:
+        for ts, src, dst, proto, sport, dport, length in sorted(records):
+            w.write(ts, frame(src, dst, proto, sport, dport, length), length)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "pcaps"))
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    a = ap.parse_args()
+    for name in a.scenarios:
+        if name not in SCENARIOS: ap.error(f"unknown scenario {name}")
+    os.makedirs(a.out, exist_ok=True)
+    for name in a.scenarios or SCENARIOS:
+        path = os.path.join(a.out, name + ".pcap")
+        write(path, SCENARIOS[name](random.Random(f"{a.seed}:{name}")))
+        print(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Minimal packet view shared by all capture backends.
+
+PacketInfo carries only the fields the rules, blocker and event writer use.
+parse_ipv4() fills it straight from raw bytes with struct; from_scapy()
+adapts a scapy packet, so the detection logic never touches scapy objects.
+"""
+import socket, struct
+
+_PORTS = struct.Struct("!HH")
+PROTO_TCP, PROTO_UDP = 6, 17
+
+class PacketInfo:
+    __slots__ = ("ts", "src", "dst", "proto", "length", "sport", "dport")
+
+    def __init__(self, ts, src, dst, proto, length, sport=None, dport=None):
+        self.ts = ts; self.src = src; self.dst = dst; self.proto = proto
+        self.length = length; self.sport = sport; self.dport = dport
+
+def parse_ipv4(buf, off: int, ts: float, length: int):
+    """IPv4 header at buf[off:]; length is the captured frame length on the wire.
+    Returns None for anything that is not a complete IPv4 header."""
+    if len(buf) < off + 20 or buf[off] >> 4 != 4: return None
+    ihl = (buf[off] & 0x0f) * 4
+    proto = buf[off + 9]
+    src = socket.inet_ntoa(buf[off + 12:off + 16])
+    dst = socket.inet_ntoa(buf[off + 16:off + 20])
+    sport = dport = None
+    # ports only in the first fragment
+    if proto in (PROTO_TCP, PROTO_UDP) and not (buf[off + 6] & 0x1f or buf[off + 7]) \
+            and len(buf) >= off + ihl + 4:
+        sport, dport = _PORTS.unpack_from(buf, off + ihl)
+    return PacketInfo(ts, src, dst, proto, length, sport, dport)
+
+def from_scapy(pkt):
+    ip = pkt.getlayer("IP")
+    if ip is None: return None
+    l4 = pkt.getlayer("TCP")
+    if l4 is None: l4 = pkt.getlayer("UDP")
+    return PacketInfo(float(pkt.time), ip.src, ip.dst, ip.proto, len(pkt),
+                      l4.sport if l4 is not None else None,
+                      l4.dport if l4 is not None else None)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Classic libpcap files: a reader yielding PacketInfo and a small writer.
+
+read_pcap() maps the file and parses records in place with struct, both
+byte orders, micro- and nanosecond timestamps. Link types: Ethernet (with
+one 802.1Q tag), BSD loopback, raw IP, Linux cooked v1/v2. pcapng is not
+supported; convert with `editcap -F pcap`.
+"""
+import mmap, struct
+from packets import parse_ipv4
+
+MAGIC_US, MAGIC_NS = 0xa1b2c3d4, 0xa1b23c4d
+LINKTYPE_NULL, LINKTYPE_ETHERNET, LINKTYPE_RAW = 0, 1, 101
+LINKTYPE_LINUX_SLL, LINKTYPE_IPV4, LINKTYPE_LINUX_SLL2 = 113, 228, 276
+ETH_P_IP, ETH_P_8021Q = 0x0800, 0x8100
+
+_U16BE = struct.Struct("!H")
+
+def _ip_offset(buf, off: int, linktype: int):
+    """Offset of the IPv4 header in the frame at buf[off:], None if not IPv4."""
+    if linktype == LINKTYPE_ETHERNET:
+        etype = _U16BE.unpack_from(buf, off + 12)[0]
+        if etype == ETH_P_8021Q:
+            return off + 18 if _U16BE.unpack_from(buf, off + 16)[0] == ETH_P_IP else None
+        return off + 14 if etype == ETH_P_IP else None
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4): return off
+    if linktype == LINKTYPE_NULL: return off + 4
+    if linktype == LINKTYPE_LINUX_SLL:
+        return off + 16 if _U16BE.unpack_from(buf, off + 14)[0] == ETH_P_IP else None
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return off + 20 if _U16BE.unpack_from(buf, off)[0] == ETH_P_IP else None
+    raise ValueError(f"unsupported pcap link type {linktype}")
+
+def read_pcap(path: str):
+    """Yields a PacketInfo per record (None for non-IPv4 frames), in file order."""
+    with open(path, "rb") as f:
+        head = f.read(24)
+        if len(head) < 24: return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            magic = struct.unpack_from("<I", head)[0]
+            order = "<"
+            if magic not in (MAGIC_US, MAGIC_NS):
+                order = ">"
+                magic = struct.unpack_from(">I", head)[0]
+                if magic not in (MAGIC_US, MAGIC_NS): raise ValueError(f"{path}: not a pcap file")
+            scale = 1e-9 if magic == MAGIC_NS else 1e-6
+            linktype = struct.unpack_from(order + "I", head, 20)[0] & 0xffff
+            rec = struct.Struct(order + "IIII")   # ts_sec, ts_frac, incl_len, orig_len
+            off, size = 24, len(buf)
+            while off + 16 <= size:
+                sec, frac, incl, orig = rec.unpack_from(buf, off)
+                off += 16
+                end = off + incl
+                if end > size: break                # truncated last record
+                try: ip = _ip_offset(buf, off, linktype) if incl >= 20 else None
+                except struct.error: ip = None
+                # only the IP and L4 headers are parsed, copy no more than that
+                yield None if ip is None else parse_ipv4(buf[ip:min(end, ip + 64)], 0,
+                                                         sec + frac * scale, orig)
+                off = end
+
+class PcapWriter:
+    """Little-endian microsecond pcap; write(ts, frame) per record."""
+    def __init__(self, path: str, linktype: int = LINKTYPE_ETHERNET, snaplen: int = 65535):
+        self.f = open(path, "wb")
+        self.f.write(struct.pack("<IHHiIII", MAGIC_US, 2, 4, 0, 0, snaplen, linktype))
+
+    def write(self, ts: float, frame: bytes, orig_len: int | None = None):
+        sec = int(ts); usec = int(round((ts - sec) * 1e6))
+        if usec == 1000000: sec += 1; usec = 0
+        self.f.write(struct.pack("<IIII", sec, usec, len(frame), orig_len or len(frame)))
+        self.f.write(frame)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""IPv4 prefix tables with longest-prefix-match lookup.
+
+PrefixTrie is a path-compressed binary (PATRICIA) trie keyed on integer
+addresses: a node exists only where a stored prefix ends or two prefixes
+diverge, so a lookup visits at most 33 nodes whatever the number of
+entries. Nodes live in parallel typed arrays (key, length, two child
+indexes, a float value; NaN = no prefix ends here), about 21 bytes per
+node and at most two nodes per prefix, against roughly 100 bytes per
+string key in a dict. Values are floats (the blocker stores expiry times).
+"""
+import math, socket, struct
+from array import array
+
+_U32 = struct.Struct("!I")
+NONE = -1           # no child
+_NAN = math.nan
+
+def addr_int(ip: str) -> int:
+    return _U32.unpack(socket.inet_aton(ip))[0]
+
+def int_addr(n: int) -> str:
+    return socket.inet_ntoa(_U32.pack(n))
+
+def parse_prefix(text: str) -> tuple[int, int]:
+    """'10.0.0.0/16' or '10.1.2.3' -> (network int, prefix length); host bits are cleared."""
+    ip, _, plen = text.strip().partition("/")
+    n = 32 if not plen else int(plen)
+    if not 0 <= n <= 32: raise ValueError(f"bad prefix length in {text!r}")
+    if ip.count(".") != 3: raise ValueError(f"not an IPv4 address: {text!r}")
+    try: a = addr_int(ip)
+    except OSError: raise ValueError(f"not an IPv4 address: {text!r}") from None
+    return a & _mask(n), n
+
+def format_prefix(key: int, n: int) -> str:
+    return int_addr(key) if n == 32 else f"{int_addr(key)}/{n}"
+
+def _mask(n: int) -> int:
+    return (0xffffffff << (32 - n)) & 0xffffffff
+
+def _bit(a: int, i: int) -> int:
+    # i-th bit from the top, 0-based
+    return (a >> (31 - i)) & 1
+
+def _common(a: int, b: int, limit: int) -> int:
+    """Length of the common leading bits of a and b, at most limit."""
+    d = (a ^ b) & _mask(limit)
+    return limit if not d else 32 - d.bit_length()
+
+class PrefixTrie:
+    def __init__(self):
+        self.key = array("I")
+        self.plen = array("B")
+        self.kids = (array("i"), array("i"))
+        self.value = array("d")
+        self.free = []              # recycled node indexes
+        self.root = NONE
+        self.size = 0
+
+    def _node(self, key: int, n: int, value: float = _NAN) -> int:
+        if self.free:
+            i = self.free.pop()
+            self.key[i] = key; self.plen[i] = n; self.value[i] = value
+            self.kids[0][i] = self.kids[1][i] = NONE
+            return i
+        self.key.append(key); self.plen.append(n); self.value.append(value)
+        self.kids[0].append(NONE); self.kids[1].append(NONE)
+        return len(self.key) - 1
+
+    def _link(self, parent: int, side: int, i: int):
+        if parent == NONE: self.root = i
+        else: self.kids[side][parent] = i
+
+    def insert(self, prefix: str, value: float = 1.0):
+        self.insert_int(*parse_prefix(prefix), value)
+
+    def insert_int(self, key: int, n: int, value: float = 1.0):
+        parent, side, i = NONE, 0, self.root
+        while i != NONE:
+            ilen = self.plen[i]
+            c = _common(key, self.key[i], min(n, ilen))
+            if c == ilen == n:                       # same prefix
+                if self.value[i] != self.value[i]: self.size += 1
+                self.value[i] = value
+                return
+            if c == ilen:                            # node covers key: descend
+                parent, side = i, _bit(key, c)
+                i = self.kids[side][i]
+                continue
+            new = self._node(key, n, value)
+            if c == n:                               # key covers node: new node above it
+                self.kids[_bit(self.key[i], n)][new] = i
+            else:                                    # diverge at bit c: add a fork
+                fork = self._node(key & _mask(c), c)
+                self.kids[_bit(key, c)][fork] = new
+                self.kids[_bit(self.key[i], c)][fork] = i
+                new = fork
+            self._link(parent, side, new)
+            self.size += 1
+            return
+        self._link(parent, side, self._node(key, n, value))
+        self.size += 1
+
+    def match_int(self, a: int):
+        """(key, length, value) of the longest stored prefix containing a, or None."""
+        key, plen, value, kids = self.key, self.plen, self.value, self.kids
+        best = None
+        i = self.root
+        while i != NONE:
+            n = plen[i]
+            if n and (a ^ key[i]) >> (32 - n): break
+            v = value[i]
+            if v == v: best = (key[i], n, v)
+            if n == 32: break
+            i = kids[(a >> (31 - n)) & 1][i]
+        return best
+
+    def covers_int(self, key: int, n: int) -> bool:
+        """True if some stored prefix of length <= n contains the whole prefix key/n."""
+        plen, value, kids = self.plen, self.value, self.kids
+        i = self.root
+        while i != NONE:
+            m = plen[i]
+            if m > n or (m and (key ^ self.key[i]) >> (32 - m)): return False
+            if value[i] == value[i]: return True
+            i = kids[(key >> (31 - m)) & 1][i] if m < 32 else NONE
+        return False
+
+    def lookup_int(self, a: int, default=None):
+        """Value of the longest stored prefix containing address a."""
+        key, plen, value, kids = self.key, self.plen, self.value, self.kids
+        best = default
+        i = self.root
+        while i != NONE:
+            n = plen[i]
+            if n and (a ^ key[i]) >> (32 - n): break
+            v = value[i]
+            if v == v: best = v
+            if n == 32: break
+            i = kids[(a >> (31 - n)) & 1][i]
+        return best
+
+    def lookup(self, ip: str, default=None):
+        return self.lookup_int(addr_int(ip), default)
+
+    def _find(self, key: int, n: int):
+        """(node, path of (parent, side)) for an exact prefix, node NONE if absent."""
+        path = []
+        i = self.root
+        while i != NONE and self.plen[i] <= n:
+            ilen = self.plen[i]
+            if _common(key, self.key[i], ilen) < ilen: break
+            if ilen == n:
+                return (i, path) if self.key[i] == key and self.value[i] == self.value[i] else (NONE, path)
+            side = _bit(key, ilen)
+            path.append((i, side))
+            i = self.kids[side][i]
+        return NONE, path
+
+    def get(self, prefix: str, default=None):
+        """Exact-prefix lookup."""
+        return self.get_int(*parse_prefix(prefix), default)
+
+    def get_int(self, key: int, n: int, default=None):
+        i, _ = self._find(key, n)
+        return default if i == NONE else self.value[i]
+
+    def delete(self, prefix: str, default=None):
+        return self.delete_int(*parse_prefix(prefix), default)
+
+    def delete_int(self, key: int, n: int, default=None):
+        """Removes an exact prefix; returns its value (default if absent)."""
+        i, path = self._find(key, n)
+        if i == NONE: return default
+        value = self.value[i]
+        self.value[i] = _NAN
+        self.size -= 1
+        # drop nodes left without a value and with fewer than two children
+        while i != NONE and self.value[i] != self.value[i]:
+            kids = [c for c in (self.kids[0][i], self.kids[1][i]) if c != NONE]
+            if len(kids) == 2: break
+            parent, side = path.pop() if path else (NONE, 0)
+            self._link(parent, side, kids[0] if kids else NONE)
+            self.free.append(i)
+            i = parent
+        return value
+
+    def items(self):
+        """(prefix string, value) pairs."""
+        stack = [self.root] if self.root != NONE else []
+        while stack:
+            i = stack.pop()
+            v = self.value[i]
+            if v == v: yield format_prefix(self.key[i], self.plen[i]), v
+            for c in (self.kids[1][i], self.kids[0][i]):
+                if c != NONE: stack.append(c)
+
+    def clear(self):
+        self.__init__()
+
+    def __contains__(self, ip: str):
+        return self.lookup(ip) is not None
+
+    def __iter__(self):
+        return (p for p, _ in self.items())
+
+    def __len__(self):
+        return self.size
@@ -1,19 +1,19 @@
-from scapy.all import IP, TCP, UDP
+from state import BoundedTable
+from packets import PROTO_TCP, PROTO_UDP
 
 
-state={"counts":{},"ports_common":{80,443,53,123,22,25,110,143,587,993,995}}
+# counts: per-src packet counter, idle sources expire (caps set from detector CLI)
+state={"counts":BoundedTable("rate_counts", 100000, 300),"ports_common":{80,443,53,123,22,25,110,143,587,993,995}}
 
 
 def rule_high_packet_rate(pkt, st):
-    if IP not in pkt: return False, ""
-    s=pkt[IP].src
-    st["counts"].setdefault(s,0)
-    st["counts"][s]+=1
-    return st["counts"][s]%20==0, "high_rate"
+    s=pkt.src
+    c=st["counts"].get(s,0)+1
+    st["counts"].touch(s,c)
+    return c%20==0, "high_rate"
 
 
 def rule_unusual_port(pkt, st):
-    if TCP in pkt: d=pkt[TCP].dport
-    elif UDP in pkt: d=pkt[UDP].dport
-    else: return False, ""
+    if pkt.proto not in (PROTO_TCP, PROTO_UDP) or pkt.dport is None: return False, ""
+    d=pkt.dport
     return d not in st["ports_common"], f"port_{d}"
\ No newline at end of file
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Bounded detector state: per-table size caps and idle TTLs.
+
+A BoundedTable keeps its entries in last-touch order (OrderedDict), so the
+coldest entry is always at the front. Every touch drops front entries that
+are idle longer than the TTL or exceed the cap; each entry is evicted at
+most once, so the cost is amortized O(1) per packet. All tables register
+here by name (probes add structures that bound themselves) so their sizes
+and eviction counts can be reported.
+"""
+import time
+from collections import OrderedDict
+
+tables = {}     # name -> BoundedTable
+probes = {}     # name -> callable returning a stats dict
+
+class BoundedTable:
+    def __init__(self, name: str | None = None, cap: int = 0, ttl: float = 0, clock=time.time):
+        self.name = name
+        self.cap = cap              # 0 = unlimited
+        self.ttl = ttl              # 0 = no idle expiry
+        self.clock = clock
+        self.data = OrderedDict()   # key -> [last touch, value]
+        self.evicted_ttl = 0
+        self.evicted_cap = 0
+        if name: tables[name] = self
+
+    def get(self, key, default=None):
+        e = self.data.get(key)
+        return default if e is None else e[1]
+
+    def touch(self, key, value, now: float | None = None):
+        """Store value under key and mark it as just used."""
+        if now is None: now = self.clock()
+        e = self.data.get(key)
+        if e is None:
+            self.data[key] = [now, value]
+        else:
+            e[0] = now; e[1] = value
+            self.data.move_to_end(key)
+        self.evict(now)
+
+    def pop(self, key, default=None):
+        e = self.data.pop(key, None)
+        return default if e is None else e[1]
+
+    def evict(self, now: float | None = None):
+        data = self.data
+        if self.cap:
+            while len(data) > self.cap:
+                data.popitem(last=False)
+                self.evicted_cap += 1
+        if self.ttl and data:
+            if now is None: now = self.clock()
+            limit = now - self.ttl
+            while data:
+                key, e = next(iter(data.items()))
+                if e[0] >= limit: break
+                del data[key]
+                self.evicted_ttl += 1
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self) -> dict:
+        return {"size": len(self.data), "cap": self.cap, "ttl": self.ttl,
+                "evicted_ttl": self.evicted_ttl, "evicted_cap": self.evicted_cap}
+
+def stats() -> dict:
+    out = {name: t.stats() for name, t in tables.items()}
+    for name, fn in probes.items():
+        out[name] = fn()
+    return out
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Enforcer batching and the generated nft/ipset scripts, without root.
+
+RecordEnforcer runs the shared queue/flush logic for real; the kernel
+backends are built with the tool lookup patched and only their script()
+output is checked, nothing is applied.
+Run: python -m unittest test_enforce
+"""
+import json, os, tempfile, unittest
+from unittest import mock
+import enforce
+
+class RecordEnforcerTest(unittest.TestCase):
+    def test_last_op_per_address_wins(self):
+        e = enforce.create("record")
+        e.block("10.0.0.1", 60); e.unblock("10.0.0.1")
+        e.block("10.0.0.2"); e.allow("10.0.0.2"); e.disallow("10.0.0.2")
+        e.lockdown(30); e.lockdown(-5)
+        e.flush()
+        self.assertEqual(e.log, [[("unblock", "10.0.0.1"), ("block", "10.0.0.2", None),
+                                  ("disallow", "10.0.0.2"), ("lockdown", None, 0)]])
+        self.assertEqual((e.transactions, e.ops), (1, 4))
+
+    def test_empty_flush_is_not_a_transaction(self):
+        e = enforce.create("record")
+        e.flush()
+        e.block("192.168.0.0/16", 10); e.flush(); e.flush()
+        self.assertEqual(e.log, [[("block", "192.168.0.0/16", 10)]])
+        self.assertEqual(e.stats()["transactions"], 1)
+
+    def test_non_ipv4_skipped(self):
+        e = enforce.create("record")
+        e.block("2001:db8::1"); e.allow("not-an-ip"); e.unblock("::1")
+        e.flush()
+        self.assertEqual(e.log, [])
+        self.assertEqual(e.stats()["skipped_non_ipv4"], 2)
+
+    def test_record_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "enforce.jsonl")
+            with open(path, "w") as f: f.write("stale\n")
+            e = enforce.create("record", record_path=path)
+            e.block("1.2.3.4", 5); e.flush()
+            e.lockdown(0); e.flush()
+            with open(path, encoding="utf-8") as f: lines = [json.loads(l) for l in f]
+        self.assertEqual(lines, [{"ops": [["block", "1.2.3.4", 5]]}, {"ops": [["lockdown", None, 0]]}])
+
+    def test_failed_apply_is_counted_and_dropped(self):
+        class Failing(enforce.RecordEnforcer):
+            def apply(self, ops): raise RuntimeError("boom")
+        e = Failing()
+        e.block("1.2.3.4")
+        with mock.patch("sys.stderr"): e.flush()
+        self.assertEqual((e.failures, e.transactions, e.stats()["pending"]), (1, 0, 0))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError): enforce.create("pf")
+
+class ScriptTest(unittest.TestCase):
+    def setUp(self):
+        which = mock.patch("shutil.which", return_value="/usr/sbin/tool")
+        which.start(); self.addCleanup(which.stop)
+
+    def test_nft_sets_per_prefix_length(self):
+        e = enforce.NftEnforcer("t")
+        script = e.script([("block", "10.0.0.0/8", 60), ("block", "1.2.3.4", None),
+                           ("allow", "192.168.1.0/24"), ("lockdown", None, 0)]).splitlines()
+        # set definitions and rules come before the elements that use them
+        self.assertEqual(script[:6], [
+            "add set inet t allow4_24 { type ipv4_addr; flags interval; }",
+            "add rule inet t allow ip saddr @allow4_24 accept",
+            "add set inet t blocked4_32 { type ipv4_addr; flags interval, timeout; }",
+            "add rule inet t deny ip saddr @blocked4_32 drop",
+            "add set inet t blocked4_8 { type ipv4_addr; flags interval, timeout; }",
+            "add rule inet t deny ip saddr @blocked4_8 drop"])
+        self.assertIn("add element inet t blocked4_8 { 10.0.0.0/8 timeout 60s }", script)
+        self.assertIn("add element inet t blocked4_32 { 1.2.3.4 }", script)
+        self.assertEqual(script[-2:], ["add element inet t lockdown4 { 0.0.0.0/0 }",
+                                       "delete element inet t lockdown4 { 0.0.0.0/0 }"])
+        # sets the table already has are not defined again
+        e.sets |= e.new_sets; e.new_sets.clear()
+        again = e.script([("unblock", "10.0.0.0/8")])
+        self.assertNotIn("add set", again)
+        self.assertEqual(e.new_sets, set())
+
+    def test_nft_setup_accepts_established_first(self):
+        e = enforce.NftEnforcer("t")
+        with mock.patch("enforce._run") as run: e.setup()
+        chain = run.call_args[0][1].split("chain input")[1]
+        rules = [l.strip() for l in chain.splitlines() if l.strip() and not l.strip().startswith("#")]
+        self.assertEqual(rules[2:7], ["ct state established,related accept", "iif lo accept", "jump allow",
+                                      "ip saddr @lockdown4 drop", "jump deny"])
+
+    def test_ipset_script(self):
+        e = enforce.IpsetEnforcer("ids")
+        self.assertEqual(e.script([("block", "1.2.3.4", 30), ("allow", "10.0.0.0/8"),
+                                   ("lockdown", None, 5)]).splitlines(), [
+            "add ids-blocked 1.2.3.4 timeout 30 -exist",
+            "add ids-allow 10.0.0.0/8 -exist",
+            "add ids-lockdown 0.0.0.0/1 timeout 5 -exist",
+            "add ids-lockdown 128.0.0.0/1 timeout 5 -exist"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""PrefixTrie against a brute-force scan of the same prefixes.
+
+Addresses are drawn near the stored prefixes (and at random) so most
+lookups hit nested and adjacent entries rather than falling through.
+Run: python -m unittest test_radix
+"""
+import random, unittest
+from radix import PrefixTrie, parse_prefix, format_prefix, _mask
+
+def brute_match(table: dict, a: int):
+    best = None
+    for (key, n), v in table.items():
+        if a & _mask(n) == key and (best is None or n > best[1]): best = (key, n, v)
+    return best
+
+def brute_covers(table: dict, key: int, n: int) -> bool:
+    return any(m <= n and key & _mask(m) == k for (k, m) in table)
+
+class PrefixTrieTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1234)
+
+    def random_table(self, count: int) -> dict:
+        table = {}
+        bases = [self.rng.getrandbits(32) for _ in range(8)]
+        for i in range(count):
+            # clustered around a few bases, so prefixes nest and share branches
+            a = self.rng.choice(bases) ^ self.rng.getrandbits(self.rng.randint(0, 16))
+            n = self.rng.choice((0, 8, 12, 16, 20, 24, 28, 31, 32, self.rng.randint(0, 32)))
+            table[(a & _mask(n), n)] = float(i)
+        return table
+
+    def probes(self, table: dict, count: int):
+        keys = [k for k, _ in table] or [0]
+        for _ in range(count):
+            if self.rng.random() < 0.7: yield self.rng.choice(keys) ^ self.rng.getrandbits(self.rng.randint(0, 12))
+            else: yield self.rng.getrandbits(32)
+
+    def build(self, table: dict) -> PrefixTrie:
+        t = PrefixTrie()
+        for (key, n), v in table.items(): t.insert_int(key, n, v)
+        return t
+
+    def test_lookup_matches_brute_force(self):
+        for _ in range(20):
+            table = self.random_table(self.rng.randint(1, 200))
+            t = self.build(table)
+            self.assertEqual(len(t), len(table))
+            for a in self.probes(table, 300):
+                best = brute_match(table, a)
+                self.assertEqual(t.match_int(a), best)
+                self.assertEqual(t.lookup_int(a), best[2] if best else None)
+
+    def test_covers_matches_brute_force(self):
+        for _ in range(20):
+            table = self.random_table(self.rng.randint(1, 100))
+            t = self.build(table)
+            for a in self.probes(table, 200):
+                n = self.rng.randint(0, 32)
+                key = a & _mask(n)
+                self.assertEqual(t.covers_int(key, n), brute_covers(table, key, n), format_prefix(key, n))
+
+    def test_delete_and_reinsert(self):
+        table = self.random_table(300)
+        t = self.build(table)
+        for k in self.rng.sample(sorted(table), len(table) // 2):
+            self.assertEqual(t.delete_int(*k), table.pop(k))
+            self.assertIsNone(t.delete_int(*k))
+        self.assertEqual(len(t), len(table))
+        self.assertEqual(dict(t.items()), {format_prefix(*k): v for k, v in table.items()})
+        for a in self.probes(table, 500):
+            self.assertEqual(t.match_int(a), brute_match(table, a))
+        # recycled nodes must not leak old values or children
+        extra = self.random_table(100)
+        for (key, n), v in extra.items(): t.insert_int(key, n, v + 1000)
+        table.update({k: v + 1000 for k, v in extra.items()})
+        for a in self.probes(table, 500):
+            self.assertEqual(t.match_int(a), brute_match(table, a))
+
+    def test_string_api(self):
+        t = PrefixTrie()
+        t.insert("10.0.0.0/8", 1.0)
+        t.insert("10.1.2.3", 2.0)
+        self.assertEqual(t.lookup("10.1.2.3"), 2.0)
+        self.assertEqual(t.lookup("10.9.9.9"), 1.0)
+        self.assertNotIn("11.0.0.1", t)
+        self.assertEqual(t.get("10.0.0.0/8"), 1.0)
+        self.assertIsNone(t.get("10.0.0.0/9"))
+        self.assertEqual(parse_prefix("10.1.2.3/8"), parse_prefix("10.0.0.0/8"))
+        for bad in ("10.0.0/8", "10.0.0.0/33", "a.b.c.d"):
+            with self.assertRaises(ValueError): parse_prefix(bad)
+
+if __name__ == "__main__":
+    unittest.main()